@@ -1,41 +1,63 @@
-from pymongo import MongoClient 
-import google.generativeai as genai
+from datetime import datetime
+from pymongo import ReturnDocument
+from database.db import AsyncCollection
+from llm.gateway import llm_gateway
+from .response_cache import response_cache
 from dotenv import load_dotenv
 import os
-
-# Loading gemini
 load_dotenv()
-gemini_api_key = os.getenv("LLM")
-if not gemini_api_key:
-    raise ValueError("GEMINI_API_KEY environment variable not set")
-genai.configure(api_key=gemini_api_key)
-model = genai.GenerativeModel("gemini-1.5-flash")
 
+# Number of recent turns kept on the user's Chatbot document
+CHATBOT_RECENT_TURNS = int(os.getenv('CHATBOT_RECENT_TURNS', 50))
+# Number of turns per history bucket document
+CHATBOT_BUCKET_SIZE = int(os.getenv('CHATBOT_BUCKET_SIZE', 100))
+
+# Chatbot collections on the shared Mongo client
+convo = AsyncCollection("Chatbot")
+history = AsyncCollection("Chatbot_history")
 
-# Connecting to Mongo
-Mongo_url = os.getenv('mongo')
-client = MongoClient(Mongo_url)
-db = client["Mini_Project"]
-convo = db["Chatbot"]
 
+async def ensure_indexes():
+    await convo.create_index("username")
+    await history.create_index([("username", 1), ("bucket", 1)], unique=True)
 
-def get_chatbot_response(user_message, user_id,  is_first_message=False):
-    user_data = convo.find_one({'username': user_id})
+
+# Checking whether the user has talked to the bot before
+async def load_conversation(user_id, is_first_message=False):
+    user_data = await convo.find_one({'username': user_id}, {'_id': 1, 'turn_count': 1})
     # print(user_data)
     if not user_data:
-        convo.insert_one({'username': user_id})
-        convo.update_one(
-        {'username': user_id},  
-        {'$set': {'conversation_log': []}}  
-        )
         is_first_message = True
-        convo_log = []
-    else:    
-        convo_log = user_data.get('conversation_log', [])
-    if is_first_message:
-        prompt = "Ask only the content given in the backticks `Hello! How can I assist you today?`"
-    else:
-        prompt = f"""Role: You are an AI assistant for the **Proximity-Based Professional Locator** project. Your role is to assist users with queries related to the project while maintaining professionalism and ethical standards.
+    elif 'turn_count' not in user_data:
+        await migrate_legacy(await convo.find_one({'_id': user_data['_id']}, {'username': 1, 'conversation_log': 1}))
+    return is_first_message
+
+
+# Moving a conversation log written before the bucketed history into
+# buckets, by manage.py or on the user's next turn, whichever comes first.
+# Claimed by setting turn_count so it only happens once; the turns are
+# merged by seq with any saved into the same bucket meanwhile
+async def migrate_legacy(user_data):
+    log = user_data.get('conversation_log', [])
+    claimed = await convo.update_one(
+        {'_id': user_data['_id'], 'turn_count': {'$exists': False}},
+        {'$set': {'conversation_log': log[-CHATBOT_RECENT_TURNS:], 'turn_count': len(log)}},
+    )
+    if not claimed.modified_count:
+        return False
+    for start in range(0, len(log), CHATBOT_BUCKET_SIZE):
+        turns = [dict(turn, seq=seq) for seq, turn in enumerate(log[start:start + CHATBOT_BUCKET_SIZE], start + 1)]
+        await history.update_one(
+            {'username': user_data['username'], 'bucket': start // CHATBOT_BUCKET_SIZE},
+            {'$push': {'turns': {'$each': turns, '$sort': {'seq': 1}}}},
+            upsert=True,
+        )
+    return True
+
+
+# Project instructions sent as the model's system instruction instead of
+# being repeated inside every prompt
+PROJECT_INSTRUCTIONS = """Role: You are an AI assistant for the **Proximity-Based Professional Locator** project. Your role is to assist users with queries related to the project while maintaining professionalism and ethical standards.
 
 **Project Overview**:
 - **Objective**: Help users find nearby professionals (e.g., plumbers, electricians, tutors, doctors) based on location and service preferences.
@@ -56,34 +78,108 @@ def get_chatbot_response(user_message, user_id,  is_first_message=False):
 - Always respond directly to the user's query without adding unrelated information or follow-up questions.
 - Example:
     - User: "How does the system rank professionals?"
-    - Response: "Professionals are ranked based on ratings, reviews, location proximity, and service quality using machine learning algorithms.
-    
-    User Query: {user_message}"""
+    - Response: "Professionals are ranked based on ratings, reviews, location proximity, and service quality using machine learning algorithms."""
 
-    response = model.generate_content(prompt)
-    bot_response = response.text
+GREETING_PROMPT = "Ask only the content given in the backticks `Hello! How can I assist you today?`"
+
+
+# Returns the prompt and the system instruction for a turn
+def build_prompt(user_message, is_first_message):
+    if is_first_message:
+        return GREETING_PROMPT, None
+    return f"User Query: {user_message}", PROJECT_INSTRUCTIONS
 
-    convo_log.append({
+
+# The answer only depends on the user's query, so it can be shared between users
+def cached_response(user_message, is_first_message):
+    if response_cache is None or is_first_message:
+        return None
+    return response_cache.get(user_message)
+
+
+def cache_response(user_message, is_first_message, bot_response):
+    if response_cache is not None and not is_first_message:
+        response_cache.set(user_message, bot_response)
+
+
+# Appending a finished turn: the recent window on the Chatbot document is
+# capped with $slice and the full history goes into fixed-size buckets
+async def save_turn(user_id, user_message, bot_response):
+    turn = {
         "user_message": user_message,
         "bot_response": bot_response
-    })
-    convo.update_one(
+    }
+    user_data = await convo.find_one_and_update(
         {'username': user_id},
-        {'$set': {'conversation_log': convo_log}}
+        {
+            '$push': {'conversation_log': {'$each': [turn], '$slice': -CHATBOT_RECENT_TURNS}},
+            '$inc': {'turn_count': 1},
+        },
+        projection={'_id': 0, 'conversation_log': 1, 'turn_count': 1},
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+    seq = user_data['turn_count']
+    await history.update_one(
+        {'username': user_id, 'bucket': (seq - 1) // CHATBOT_BUCKET_SIZE},
+        {'$push': {'turns': dict(turn, seq=seq, timestamp=datetime.utcnow())}},
+        upsert=True,
     )
+    return user_data['conversation_log']
+
 
+async def get_chatbot_response(user_message, user_id,  is_first_message=False):
+    is_first_message = await load_conversation(user_id, is_first_message)
+    prompt, system = build_prompt(user_message, is_first_message)
+    bot_response = cached_response(user_message, is_first_message)
+    if bot_response is None:
+        bot_response = await llm_gateway.generate(prompt, user=user_id, system=system)
+        cache_response(user_message, is_first_message, bot_response)
+    convo_log = await save_turn(user_id, user_message, bot_response)
     return bot_response, convo_log
 
 
-def get_conversation_history(user_id):
-    user_data = convo.find_one({'username': user_id})
-    if user_data and 'conversation_log' in user_data:
-        convo_log = user_data.get('conversation_log', [])
-        return convo_log
+# Streaming variant: yields the reply chunk by chunk, the turn is saved once the stream completes
+async def stream_chatbot_response(user_message, user_id):
+    is_first_message = await load_conversation(user_id)
+    prompt, system = build_prompt(user_message, is_first_message)
+    bot_response = cached_response(user_message, is_first_message)
+    if bot_response is not None:
+        yield bot_response
     else:
-        convo.insert_one({'username': user_id})
-        convo.update_one(
-        {'username': user_id},  
-        {'$set': {'conversation_log': []}}  
-        )
-        return []
\ No newline at end of file
+        chunks = []
+        async for chunk in llm_gateway.stream(prompt, user=user_id, system=system):
+            chunks.append(chunk)
+            yield chunk
+        bot_response = "".join(chunks)
+        cache_response(user_message, is_first_message, bot_response)
+    await save_turn(user_id, user_message, bot_response)
+
+
+# The recent turns shown when the chatbot screen opens. Opening it creates
+# the user's document, so their first question gets a real answer rather
+# than the greeting
+async def get_conversation_history(user_id):
+    user_data = await convo.find_one_and_update(
+        {'username': user_id},
+        {'$setOnInsert': {'conversation_log': [], 'turn_count': 0}},
+        projection={'_id': 0, 'conversation_log': 1},
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+    return user_data.get('conversation_log', [])
+
+
+# One page of the full history, newest page first: turns with seq < before, oldest first
+async def get_history_page(user_id, before=None, limit=20):
+    if before is None:
+        user_data = await convo.find_one({'username': user_id}, {'_id': 0, 'turn_count': 1})
+        before = (user_data or {}).get('turn_count', 0) + 1
+    first = max(1, before - limit)
+    if before <= first:
+        return [], None
+    buckets = list(range((first - 1) // CHATBOT_BUCKET_SIZE, (before - 2) // CHATBOT_BUCKET_SIZE + 1))
+    documents = await history.find({'username': user_id, 'bucket': {'$in': buckets}}, {'_id': 0, 'turns': 1})
+    turns = [turn for document in documents for turn in document['turns'] if first <= turn['seq'] < before]
+    turns.sort(key=lambda turn: turn['seq'])
+    return turns, (first if first > 1 else None)
\ No newline at end of file
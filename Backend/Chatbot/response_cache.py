@@ -0,0 +1,131 @@
+from collections import OrderedDict
+import re
+import time
+import zlib
+import os
+import numpy as np
+from dotenv import load_dotenv
+load_dotenv()
+
+# Chatbot response cache settings
+CHATBOT_CACHE_ENABLED = os.getenv('CHATBOT_CACHE_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+CHATBOT_CACHE_SIZE = int(os.getenv('CHATBOT_CACHE_SIZE', 2000))
+CHATBOT_CACHE_TTL = int(os.getenv('CHATBOT_CACHE_TTL', 86400))
+# Only queries with the same content words are compared, so this can sit
+# below what n-gram similarity alone would need to tell questions apart
+CHATBOT_CACHE_SIMILARITY = float(os.getenv('CHATBOT_CACHE_SIMILARITY', 0.7))
+
+VECTOR_DIM = 1024
+
+# Words that don't change what is being asked
+STOPWORDS = {
+    "a", "an", "the", "i", "me", "my", "we", "you", "your", "it", "is", "are", "am", "was", "be",
+    "do", "does", "did", "can", "could", "would", "should", "will", "how", "what", "where", "when",
+    "which", "who", "why", "to", "of", "in", "on", "for", "with", "at", "by", "from", "about",
+    "and", "or", "this", "that", "there", "please", "tell", "some", "any",
+}
+
+
+def normalize_query(query: str):
+    return " ".join(re.sub(r"[^\w\s]", " ", query.lower()).split())
+
+
+# The words that carry the question; two queries are only the same question
+# if these match, however similar the rest ("register" vs "unregister")
+def content_words(normalized: str):
+    return frozenset(word for word in normalized.split() if word not in STOPWORDS)
+
+
+# L2-normalised vector of hashed word and character trigram counts
+def vectorize(normalized: str):
+    vector = np.zeros(VECTOR_DIM, dtype=np.float32)
+    padded = f" {normalized} "
+    grams = normalized.split() + [padded[i:i + 3] for i in range(len(padded) - 2)]
+    for gram in grams:
+        vector[zlib.crc32(gram.encode()) % VECTOR_DIM] += 1
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+class ResponseCache:
+    """Answers repeated chatbot questions without an LLM call.
+
+    Queries are normalised (case, punctuation, spacing) and looked up
+    exactly first; otherwise the cached query with the highest cosine
+    similarity of hashed n-gram vectors is used if it reaches
+    CHATBOT_CACHE_SIMILARITY and asks about the same content words. Entries
+    expire after a TTL and the least recently used one is evicted when full.
+    """
+
+    def __init__(self, maxsize=CHATBOT_CACHE_SIZE, ttl=CHATBOT_CACHE_TTL, threshold=CHATBOT_CACHE_SIMILARITY):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.threshold = threshold
+        self.matrix = np.zeros((maxsize, VECTOR_DIM), dtype=np.float32)
+        self.entries = OrderedDict()
+        self.slot_keys = [None] * maxsize
+        self.slot_words = [None] * maxsize
+        self.free = list(range(maxsize - 1, -1, -1))
+        self.exact_hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+
+    def _drop(self, normalized):
+        slot, _, _ = self.entries.pop(normalized)
+        self.matrix[slot] = 0
+        self.slot_keys[slot] = None
+        self.slot_words[slot] = None
+        self.free.append(slot)
+
+    def get(self, query: str):
+        normalized = normalize_query(query)
+        now = time.monotonic()
+        entry = self.entries.get(normalized)
+        if entry is not None and entry[2] > now:
+            self.entries.move_to_end(normalized)
+            self.exact_hits += 1
+            return entry[1]
+        if self.entries:
+            words = content_words(normalized)
+            scores = self.matrix @ vectorize(normalized)
+            while True:
+                slot = int(scores.argmax())
+                if scores[slot] < self.threshold:
+                    break
+                match = self.slot_keys[slot]
+                if self.slot_words[slot] != words:
+                    scores[slot] = 0
+                    continue
+                if self.entries[match][2] > now:
+                    self.entries.move_to_end(match)
+                    self.similar_hits += 1
+                    return self.entries[match][1]
+                self._drop(match)
+                scores[slot] = 0
+        self.misses += 1
+        return None
+
+    def set(self, query: str, response: str):
+        normalized = normalize_query(query)
+        if not normalized:
+            return
+        if normalized in self.entries:
+            self._drop(normalized)
+        if not self.free:
+            self._drop(next(iter(self.entries)))
+        slot = self.free.pop()
+        self.matrix[slot] = vectorize(normalized)
+        self.slot_keys[slot] = normalized
+        self.slot_words[slot] = content_words(normalized)
+        self.entries[normalized] = (slot, response, time.monotonic() + self.ttl)
+
+    def stats(self):
+        return {
+            "size": len(self.entries),
+            "exact_hits": self.exact_hits,
+            "similar_hits": self.similar_hits,
+            "misses": self.misses,
+        }
+
+
+response_cache = ResponseCache() if CHATBOT_CACHE_ENABLED else None
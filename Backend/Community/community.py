@@ -1,44 +1,160 @@
-import google.generativeai as genai
 from dotenv import load_dotenv
 from datetime import datetime, timedelta
-from pymongo import MongoClient
+from bson import ObjectId
+from bson.errors import InvalidId
+from database.db import AsyncCollection
+from llm.gateway import llm_gateway, LLMUnavailable
+import json
 import os
 load_dotenv()
 
-# Connecting to MongoDB
-client = MongoClient(os.getenv('mongo'))
-db = client["Mini_Project"]
-messages_collection = db["Community"]
-
-# Fetching the API Key
-api_key = os.getenv("LLM")
-if not api_key:
-    raise EnvironmentError("LLM API key not found. Please check your .env file.")
-
-# Configuring LLM
-genai.configure(api_key = api_key)
-model = genai.GenerativeModel("gemini-1.5-flash")
+# Community collection on the shared Mongo client
+messages_collection = AsyncCollection("Community")
 
 # Function to determine the message sentiment
-def message_analysis(message_data):
+async def message_analysis(message_data):
     prompt = f"""Act as a professional sentiment analyzer and analyze the sentiment of the message on the basis of its context and not just the tone ex(the message can be in any language) given below in just one word (positive/negative/neutral):
     Message: "{message_data}"."""
     try:
-        response = model.generate_content(prompt)
+        response = await llm_gateway.generate(prompt)
         # print(response)
-        sentiment = response.text.strip().lower()
+        sentiment = response.strip().lower()
         return sentiment
+    except LLMUnavailable:
+        raise
     except Exception as e:
         raise RuntimeError("Failed to analyze sentiment." + str(e))
-    
-
-# Fetching the Community Chat messaages of past 2 days only
-def display_messages():
-    expiry_time = datetime.utcnow() - timedelta(days=2)
-    messages = list(messages_collection.find({"timestamp": {"$gte": expiry_time}}, {"_id": 0}))
-    return {"messages": messages}
-
-# Updating the Community DB by deleting messages older than 2 days
-def update_DB():
-    expiry_time = datetime.utcnow() - timedelta(days=2)
-    messages_collection.delete_many({"timestamp": {"$lt": expiry_time}})
\ No newline at end of file
+
+
+class BatchReplyError(RuntimeError):
+    """The batch reply could not be parsed or had the wrong number of results."""
+
+
+# Function to determine the sentiment of several messages with one LLM call
+async def batch_message_analysis(messages):
+    numbered = "\n".join(f"{i + 1}. {json.dumps(message, ensure_ascii=False)}" for i, message in enumerate(messages))
+    prompt = f"""Act as a professional sentiment analyzer and analyze the sentiment of each message below on the basis of its context and not just the tone ex(the messages can be in any language).
+    Reply with only a JSON array of {len(messages)} strings, one per message in the same order, each being one word (positive/negative/neutral).
+    Messages:
+    {numbered}"""
+    try:
+        response = await llm_gateway.generate(prompt)
+        text = response.strip()
+        text = text[text.find("["):text.rfind("]") + 1]
+        sentiments = [str(sentiment).strip().lower() for sentiment in json.loads(text)]
+    except LLMUnavailable:
+        raise
+    except Exception as e:
+        raise BatchReplyError("Failed to analyze sentiment." + str(e))
+    if len(sentiments) != len(messages):
+        raise BatchReplyError("Failed to analyze sentiment. Expected %d results, got %d" % (len(messages), len(sentiments)))
+    return sentiments
+
+
+# Community posts are kept for 2 days, Mongo's TTL monitor deletes older ones
+COMMUNITY_RETENTION_DAYS = int(os.getenv('COMMUNITY_RETENTION_DAYS', 2))
+COMMUNITY_PAGE_SIZE = int(os.getenv('COMMUNITY_PAGE_SIZE', 100))
+# published_at is set before the write, so a post can become visible after a
+# later one; since-polls re-read this far back and skip the posts already sent
+COMMUNITY_SINCE_OVERLAP_MS = int(os.getenv('COMMUNITY_SINCE_OVERLAP_MS', 5000))
+
+
+async def ensure_indexes():
+    await messages_collection.create_index("timestamp", expireAfterSeconds=COMMUNITY_RETENTION_DAYS * 86400)
+    await messages_collection.create_index([("published_at", 1), ("_id", 1)])
+    # the moderation sweep's pending posts
+    await messages_collection.create_index([("status", 1), ("claimed_until", 1)])
+    # posts stored before published_at existed are visible from their timestamp
+    await messages_collection.update_many(
+        {"published_at": {"$exists": False}, "status": {"$nin": ["pending", "rejected"]}},
+        [{"$set": {"published_at": "$timestamp"}}],
+    )
+
+
+# Current time truncated to the millisecond precision Mongo stores
+def now_ms():
+    now = datetime.utcnow()
+    return now.replace(microsecond=now.microsecond // 1000 * 1000)
+
+
+# Cursors point at a published post: "<published_at in ms>_<id>"
+def encode_cursor(message):
+    millis = int((message["published_at"] - datetime(1970, 1, 1)).total_seconds() * 1000)
+    return f"{millis}_{message['_id']}"
+
+
+def decode_cursor(cursor: str):
+    try:
+        millis, message_id = cursor.split("_", 1)
+        return datetime(1970, 1, 1) + timedelta(milliseconds=int(millis)), ObjectId(message_id)
+    except (ValueError, InvalidId):
+        raise ValueError("Invalid cursor")
+
+
+# Since cursors also list the ids already sent from the overlap window:
+# "<published_at in ms>_<id>_<id>..."
+def encode_since(published_at, message_ids):
+    millis = int((published_at - datetime(1970, 1, 1)).total_seconds() * 1000)
+    return "_".join([str(millis)] + [str(message_id) for message_id in message_ids])
+
+
+# Since cursor after the given posts (oldest first), listing those still within the overlap of the newest
+def next_since_cursor(messages, published_at=None):
+    newest = max(filter(None, [published_at, messages[-1]["published_at"]]))
+    horizon = newest - timedelta(milliseconds=COMMUNITY_SINCE_OVERLAP_MS)
+    return encode_since(newest, [message["_id"] for message in messages if message["published_at"] >= horizon])
+
+
+def decode_since(cursor: str):
+    try:
+        millis, *message_ids = cursor.split("_")
+        return datetime(1970, 1, 1) + timedelta(milliseconds=int(millis)), {ObjectId(message_id) for message_id in message_ids}
+    except (ValueError, InvalidId):
+        raise ValueError("Invalid cursor")
+
+
+def _public(message):
+    return {
+        "id": str(message["_id"]),
+        "username": message["username"],
+        "message": message["message"],
+        "timestamp": message["timestamp"],
+    }
+
+
+# Fetching the published Community Chat messages of the past 2 days, in publish order.
+# since: only the posts published after that cursor (polling for new posts)
+# before: the page of posts published just before that cursor (scrolling back)
+# otherwise the most recent page
+async def display_messages(since: str = None, before: str = None, limit: int = COMMUNITY_PAGE_SIZE):
+    expiry_time = datetime.utcnow() - timedelta(days=COMMUNITY_RETENTION_DAYS)
+    query = {"timestamp": {"$gte": expiry_time}, "published_at": {"$exists": True}}
+    projection = {"username": 1, "message": 1, "timestamp": 1, "published_at": 1}
+    if since:
+        published_at, sent = decode_since(since)
+        query["published_at"] = {"$gte": published_at - timedelta(milliseconds=COMMUNITY_SINCE_OVERLAP_MS)}
+        window = await messages_collection.find(query, projection, sort=[("published_at", 1), ("_id", 1)], limit=limit + len(sent) + 1)
+        messages = [message for message in window if message["_id"] not in sent]
+        has_more = len(messages) > limit
+        messages = messages[:limit]
+        # the posts already sent are carried over while they stay in the overlap
+        next_since = next_since_cursor([message for message in window if message["_id"] in sent] + messages, published_at) if messages else since
+    else:
+        if before:
+            published_at, message_id = decode_cursor(before)
+            query["$or"] = [
+                {"published_at": {"$lt": published_at}},
+                {"published_at": published_at, "_id": {"$lt": message_id}},
+            ]
+        messages = await messages_collection.find(query, projection, sort=[("published_at", -1), ("_id", -1)], limit=limit + 1)
+        has_more = len(messages) > limit
+        messages = messages[:limit][::-1]
+        next_since = next_since_cursor(messages) if messages else None
+    return {
+        "messages": [_public(message) for message in messages],
+        # cursor to poll from, and whether more posts are waiting
+        "next_since": next_since,
+        "has_more": has_more if since else False,
+        # cursor for the previous page, None when there is nothing older
+        "next_before": encode_cursor(messages[0]) if messages and not since and has_more else None,
+    }
@@ -0,0 +1,146 @@
+from collections import deque
+from datetime import datetime, timedelta
+import asyncio
+import json
+import os
+import time
+from .community import messages_collection, COMMUNITY_RETENTION_DAYS
+from realtime.connections import connection_manager
+from dotenv import load_dotenv
+load_dotenv()
+
+# Most recent published posts kept in memory for the community screen
+COMMUNITY_FEED_SIZE = int(os.getenv('COMMUNITY_FEED_SIZE', 2000))
+# Posts a slow subscriber may fall behind before it is dropped
+COMMUNITY_FEED_SUBSCRIBER_QUEUE = int(os.getenv('COMMUNITY_FEED_SUBSCRIBER_QUEUE', 256))
+
+
+# JSON for the socket, with datetimes in the same ISO format the HTTP routes use
+def dumps(payload):
+    return json.dumps(payload, default=lambda value: value.isoformat() if isinstance(value, datetime) else str(value))
+
+
+class CommunityFeed:
+    """Ring buffer of the recent published community posts.
+
+    The buffer is filled once from Mongo at startup and then appended to as
+    posts are published. Every post gets an increasing sequence number, so a
+    client that reconnects asks for the posts after the last one it saw and
+    only gets the ones it missed. Sequence numbers restart with the process,
+    the epoch tells a client its numbers belong to an older buffer.
+    Subscribers receive new posts as they are published through a bounded
+    queue each; one that falls too far behind is dropped and has to resume
+    from its last sequence number.
+    """
+
+    def __init__(self, maxsize=COMMUNITY_FEED_SIZE, retention_days=COMMUNITY_RETENTION_DAYS):
+        self.posts = deque(maxlen=maxsize)
+        self.retention = timedelta(days=retention_days)
+        self.seq = 0
+        # last sequence number pushed out of the full buffer
+        self.evicted = 0
+        self.epoch = int(time.time() * 1000)
+        self.subscribers = set()
+        self.ready = False
+        self.dropped_subscribers = 0
+
+    async def load(self, collection=messages_collection):
+        expiry_time = datetime.utcnow() - self.retention
+        messages = await collection.find(
+            {"timestamp": {"$gte": expiry_time}, "published_at": {"$exists": True}},
+            {"username": 1, "message": 1, "timestamp": 1, "published_at": 1},
+            sort=[("published_at", -1), ("_id", -1)],
+            limit=self.posts.maxlen,
+        )
+        self.posts.clear()
+        self.seq = 0
+        self.evicted = 0
+        self.epoch = int(time.time() * 1000)
+        for message in reversed(messages):
+            self._append(message)
+        self.ready = True
+
+    def _append(self, message):
+        self.seq += 1
+        if len(self.posts) == self.posts.maxlen:
+            self.evicted = self.posts[0]["seq"]
+        post = {
+            "seq": self.seq,
+            "id": str(message["_id"]),
+            "username": message["username"],
+            "message": message["message"],
+            "timestamp": message["timestamp"],
+        }
+        self.posts.append(post)
+        return post
+
+    # Adding a newly published post and pushing it to every subscriber
+    def publish(self, message):
+        post = self._append(message)
+        payload = dumps({"type": "community_post", **post})
+        for queue in list(self.subscribers):
+            try:
+                queue.put_nowait(payload)
+            except asyncio.QueueFull:
+                # a subscriber that cannot keep up is cut off, it resumes from its last seq
+                self.subscribers.discard(queue)
+                queue.get_nowait()  # make room for the end marker
+                queue.put_nowait(None)
+                self.dropped_subscribers += 1
+        return post
+
+    def _expire(self):
+        expiry_time = datetime.utcnow() - self.retention
+        while self.posts and self.posts[0]["timestamp"] < expiry_time:
+            self.posts.popleft()
+
+    # Posts after the given sequence number, None when the client has to reload
+    def since(self, seq: int = None, epoch: int = None, limit: int = None):
+        self._expire()
+        if seq is None:
+            posts = list(self.posts)
+            return posts[-limit:] if limit else posts
+        if epoch != self.epoch or seq > self.seq or seq < self.evicted:
+            # from before a restart, or posts it missed are no longer buffered
+            return None
+        posts = [post for post in self.posts if post["seq"] > seq]
+        return posts[:limit] if limit else posts
+
+    def subscribe(self):
+        queue = asyncio.Queue(maxsize=COMMUNITY_FEED_SUBSCRIBER_QUEUE)
+        self.subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue):
+        self.subscribers.discard(queue)
+
+    def stats(self):
+        return {
+            "ready": self.ready,
+            "posts": len(self.posts),
+            "seq": self.seq,
+            "epoch": self.epoch,
+            "subscribers": len(self.subscribers),
+            "dropped_subscribers": self.dropped_subscribers,
+        }
+
+
+community_feed = CommunityFeed()
+
+
+# Announcing a published post over the realtime bus, so the feed of every worker gets it
+async def publish_post(message):
+    await connection_manager.publish("community_post", post={
+        "_id": str(message["_id"]),
+        "username": message["username"],
+        "message": message["message"],
+        "timestamp": message["timestamp"].isoformat(),
+    })
+
+
+def _apply_post(message):
+    post = message["post"]
+    community_feed.publish(dict(post, timestamp=datetime.fromisoformat(post["timestamp"])))
+
+
+connection_manager.on("community_post", _apply_post)
@@ -0,0 +1,83 @@
+import re
+import zlib
+import os
+import numpy as np
+from dotenv import load_dotenv
+load_dotenv()
+
+# Local pre-classifier settings
+LOCAL_CLASSIFIER_ENABLED = os.getenv('LOCAL_CLASSIFIER_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+SENTIMENT_MODEL_PATH = os.getenv('SENTIMENT_MODEL_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sentiment_model.npz'))
+SENTIMENT_MODEL_THRESHOLD = float(os.getenv('SENTIMENT_MODEL_THRESHOLD', 0.9))
+
+HASH_DIM = 2 ** 16
+LABELS = ["positive", "neutral", "negative"]
+
+# Words that make a post negative whatever the context. Words like "fraud"
+# or "kill" also appear in harmless posts ("how do I report fraud"), so
+# they are left to the models
+ABUSIVE_WORDS = {
+    "idiot", "idiots", "stupid", "moron", "morons", "imbecile", "imbeciles", "scum",
+    "bastard", "bastards", "bitch", "bitches", "shit", "fuck", "fucking", "fucker",
+    "motherfucker", "asshole", "assholes", "dickhead", "cunt", "retard",
+}
+
+TOKEN_RE = re.compile(r"[a-z']+")
+
+
+def tokenize(message: str):
+    return TOKEN_RE.findall(message.lower())
+
+
+# Hashed unigram + bigram features, also used by train_sentiment_model
+def features(tokens):
+    grams = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+    return [zlib.crc32(gram.encode()) % HASH_DIM for gram in grams]
+
+
+class LocalClassifier:
+    """CPU-only sentiment stage that runs before the LLM.
+
+    A lexicon of abusive words rejects the obvious negatives; it never
+    approves a post, since a missing bad word says nothing about the rest
+    of it. When a trained linear model file is present it settles the cases
+    it is confident about, benign ones included. Everything else returns
+    None and goes on to the LLM.
+    """
+
+    def __init__(self, model_path=SENTIMENT_MODEL_PATH):
+        self.weights = None
+        self.bias = None
+        if model_path and os.path.exists(model_path):
+            model = np.load(model_path)
+            self.weights = model["weights"].astype(np.float32)
+            self.bias = model["bias"].astype(np.float32)
+        self.lexicon_hits = 0
+        self.model_hits = 0
+
+    def lexicon(self, tokens):
+        return "negative" if ABUSIVE_WORDS.intersection(tokens) else None
+
+    def model(self, tokens):
+        if self.weights is None or not tokens:
+            return None
+        scores = self.weights[:, features(tokens)].sum(axis=1) + self.bias
+        probs = np.exp(scores - scores.max())
+        probs /= probs.sum()
+        best = int(probs.argmax())
+        return LABELS[best] if probs[best] >= SENTIMENT_MODEL_THRESHOLD else None
+
+    # Returns a sentiment, or None when the message should go to the LLM
+    def classify(self, message: str):
+        tokens = tokenize(message)
+        sentiment = self.lexicon(tokens)
+        if sentiment is not None:
+            self.lexicon_hits += 1
+            return sentiment
+        sentiment = self.model(tokens)
+        if sentiment is not None:
+            self.model_hits += 1
+        return sentiment
+
+
+local_classifier = LocalClassifier() if LOCAL_CLASSIFIER_ENABLED else None
@@ -0,0 +1,120 @@
+import asyncio
+import hashlib
+import re
+import os
+from utils.cache import TTLCache
+from .community import message_analysis, batch_message_analysis, BatchReplyError
+from .local_classifier import local_classifier
+from dotenv import load_dotenv
+load_dotenv()
+
+# Moderation cache and micro-batching settings
+MODERATION_CACHE_SIZE = int(os.getenv('MODERATION_CACHE_SIZE', 10000))
+MODERATION_CACHE_TTL = int(os.getenv('MODERATION_CACHE_TTL', 86400))
+MODERATION_BATCH_WINDOW_MS = int(os.getenv('MODERATION_BATCH_WINDOW_MS', 50))
+MODERATION_BATCH_SIZE = int(os.getenv('MODERATION_BATCH_SIZE', 20))
+
+
+# Cache key that is the same for near-identical messages (case, punctuation, spacing)
+def content_key(message: str):
+    normalized = " ".join(re.sub(r"[^\w\s]", " ", message.lower()).split())
+    return hashlib.sha256(normalized.encode()).hexdigest()
+
+
+class Moderator:
+    """Sentiment classification for community posts.
+
+    Results are cached by content hash. The local classifier then settles
+    the obvious cases on CPU. Messages it is unsure about and that
+    arrive within the same short window are classified together with a
+    single LLM call; if that batch reply cannot be used each message falls
+    back to its own message_analysis call. The calls themselves go through
+    the shared LLM gateway.
+    """
+
+    def __init__(self, window_ms=MODERATION_BATCH_WINDOW_MS, batch_size=MODERATION_BATCH_SIZE):
+        self.window = window_ms / 1000
+        self.batch_size = batch_size
+        self.cache = TTLCache(maxsize=MODERATION_CACHE_SIZE, ttl=MODERATION_CACHE_TTL)
+        self.pending = {}
+        self.flush_task = None
+        self.llm_calls = 0
+        self.llm_messages = 0
+        self.batches = 0
+        self.batched_messages = 0
+
+    async def classify(self, message: str):
+        key = content_key(message)
+        sentiment = self.cache.get(key)
+        if sentiment is not None:
+            return sentiment
+        if local_classifier is not None:
+            sentiment = local_classifier.classify(message)
+            if sentiment is not None:
+                self.cache.set(key, sentiment)
+                return sentiment
+        self.llm_messages += 1
+        # identical messages already waiting share the same result
+        if key in self.pending:
+            return await asyncio.shield(self.pending[key][1])
+        future = asyncio.get_running_loop().create_future()
+        self.pending[key] = (message, future)
+        if len(self.pending) >= self.batch_size:
+            self._flush_now()
+        elif self.flush_task is None:
+            self.flush_task = asyncio.ensure_future(self._flush_later())
+        return await asyncio.shield(future)
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.window)
+        self.flush_task = None
+        self._flush_now()
+
+    def _flush_now(self):
+        if self.flush_task is not None:
+            self.flush_task.cancel()
+            self.flush_task = None
+        batch, self.pending = self.pending, {}
+        if batch:
+            asyncio.ensure_future(self._run_batch(batch))
+
+    async def _run_batch(self, batch):
+        keys = list(batch)
+        messages = [batch[key][0] for key in keys]
+        self.batches += 1
+        self.batched_messages += len(messages)
+        try:
+            if len(messages) == 1:
+                sentiments = [await self._analyze(message_analysis, messages[0])]
+            else:
+                try:
+                    sentiments = await self._analyze(batch_message_analysis, messages)
+                except BatchReplyError:
+                    # only a reply that can't be used; an unavailable LLM fails the whole batch
+                    sentiments = await asyncio.gather(*(self._analyze(message_analysis, m) for m in messages))
+        except Exception as e:
+            for key in keys:
+                if not batch[key][1].done():
+                    batch[key][1].set_exception(e)
+            return
+        for key, sentiment in zip(keys, sentiments):
+            self.cache.set(key, sentiment)
+            batch[key][1].set_result(sentiment)
+
+    async def _analyze(self, func, arg):
+        self.llm_calls += 1
+        return await func(arg)
+
+    def stats(self):
+        return {
+            "cache": self.cache.stats(),
+            "lexicon": local_classifier.lexicon_hits if local_classifier else 0,
+            "local_model": local_classifier.model_hits if local_classifier else 0,
+            "llm_messages": self.llm_messages,
+            "llm_calls": self.llm_calls,
+            "batches": self.batches,
+            "batched_messages": self.batched_messages,
+        }
+
+
+moderator = Moderator()
@@ -0,0 +1,152 @@
+from datetime import datetime, timedelta
+import asyncio
+import uuid
+import os
+from .community import messages_collection, now_ms
+from .moderation import moderator
+from .feed import publish_post
+from realtime.connections import send_to_user
+from dotenv import load_dotenv
+load_dotenv()
+
+# Accept community posts straight away and moderate them in the background
+COMMUNITY_ASYNC_MODERATION = os.getenv('COMMUNITY_ASYNC_MODERATION', 'false').lower() in ('1', 'true', 'yes')
+MODERATION_WORKERS = int(os.getenv('MODERATION_WORKERS', 4))
+MODERATION_MAX_ATTEMPTS = int(os.getenv('MODERATION_MAX_ATTEMPTS', 3))
+# How long a worker holds the posts it moderates before others may take them over
+MODERATION_LEASE = int(os.getenv('MODERATION_LEASE', 120))
+# How often every worker looks for pending posts nobody holds
+MODERATION_SWEEP_INTERVAL = float(os.getenv('MODERATION_SWEEP_INTERVAL', 60))
+
+
+class ModerationQueue:
+    """Background workers that moderate pending community posts.
+
+    A post is stored as "pending" and its id queued here. A worker claims it
+    for MODERATION_LEASE seconds, classifies it, flips it to "published" or
+    "rejected" and tells the author over their WebSocket. The claim keeps
+    several uvicorn workers from moderating the same post. Every worker
+    sweeps for pending posts that nobody holds, at start and then every
+    MODERATION_SWEEP_INTERVAL, so posts left by a crash or whose attempts ran
+    out are retried.
+    """
+
+    def __init__(self, workers=MODERATION_WORKERS, lease=MODERATION_LEASE, sweep_interval=MODERATION_SWEEP_INTERVAL):
+        self.workers = workers
+        self.lease = lease
+        self.sweep_interval = sweep_interval
+        self.owner = uuid.uuid4().hex
+        self.queue = None
+        self.queued = set()
+        self.tasks = []
+        self.published = 0
+        self.rejected = 0
+        self.failed = 0
+
+    async def start(self):
+        self.queue = asyncio.Queue()
+        self.tasks = [asyncio.ensure_future(self._worker()) for _ in range(self.workers)]
+        self.tasks.append(asyncio.ensure_future(self._sweeper()))
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+    async def _sweeper(self):
+        while True:
+            try:
+                await self.recover()
+            except Exception as e:
+                print("Moderation sweep error:", e)
+            await asyncio.sleep(self.sweep_interval)
+
+    # Queueing the pending posts no worker holds a claim on
+    async def recover(self):
+        pending = await messages_collection.find(
+            {"status": "pending", "$or": [{"claimed_until": {"$exists": False}}, {"claimed_until": {"$lt": datetime.utcnow()}}]},
+            {"_id": 1, "username": 1, "message": 1, "timestamp": 1},
+        )
+        for entry in pending:
+            if entry["_id"] not in self.queued:
+                await self.submit(entry)
+
+    # Taking or renewing the claim on a post, False when another worker holds it
+    # or it was moderated meanwhile
+    async def _claim(self, entry):
+        now = datetime.utcnow()
+        claimed = await messages_collection.find_one_and_update(
+            {"_id": entry["_id"], "status": "pending", "$or": [
+                {"claimed_until": {"$exists": False}},
+                {"claimed_until": {"$lt": now}},
+                {"claimed_by": self.owner},
+            ]},
+            {"$set": {"claimed_by": self.owner, "claimed_until": now + timedelta(seconds=self.lease)}},
+            projection={"_id": 1},
+        )
+        return claimed is not None
+
+    async def submit(self, entry: dict, attempt: int = 1):
+        self.queued.add(entry["_id"])
+        await self.queue.put((entry, attempt))
+
+    async def _worker(self):
+        while True:
+            entry, attempt = await self.queue.get()
+            self.queued.discard(entry["_id"])
+            try:
+                if await self._claim(entry):
+                    await self._moderate(entry, attempt)
+            except Exception as e:
+                print("Moderation error:", e)
+            finally:
+                self.queue.task_done()
+
+    async def _moderate(self, entry, attempt):
+        try:
+            sentiment = await moderator.classify(entry["message"])
+        except Exception as e:
+            if attempt < MODERATION_MAX_ATTEMPTS:
+                await asyncio.sleep(2 ** attempt)
+                await self.submit(entry, attempt + 1)
+            else:
+                # left as pending, swept up again once the claim runs out
+                self.failed += 1
+                print("Moderation failed:", e)
+            return
+        status = "rejected" if sentiment == "negative" else "published"
+        update = {"status": status, "sentiment": sentiment, "moderated_at": datetime.utcnow()}
+        if status == "published":
+            update["published_at"] = now_ms()
+        # only while the claim is still ours: if the lease ran out during a slow
+        # classification another worker may have taken the post over
+        result = await messages_collection.update_one(
+            {"_id": entry["_id"], "status": "pending", "claimed_by": self.owner},
+            {"$set": update, "$unset": {"claimed_by": "", "claimed_until": ""}},
+        )
+        if result.modified_count != 1:
+            return
+        if status == "published":
+            self.published += 1
+            await publish_post({**entry, **update})
+        else:
+            self.rejected += 1
+        await send_to_user(entry["username"], {
+            "type": "community_moderation",
+            "status": status,
+            # not "message", which the chat screen would show as a chat bubble
+            "post": entry["message"],
+            "sentiment": sentiment,
+        })
+
+    def stats(self):
+        return {
+            "queued": len(self.queued),
+            "published": self.published,
+            "rejected": self.rejected,
+            "failed": self.failed,
+        }
+
+
+moderation_queue = ModerationQueue()
@@ -0,0 +1,73 @@
+"""Train the linear model used by the local sentiment pre-classifier.
+
+The input is a JSONL file with {"message": ..., "sentiment": "positive|neutral|negative"}
+per line, e.g. past community posts labelled by the LLM. Run from the Backend directory:
+
+    python -m Community.train_sentiment_model labelled_posts.jsonl -o Community/sentiment_model.npz
+"""
+import argparse
+import json
+import numpy as np
+from Community.local_classifier import HASH_DIM, LABELS, tokenize, features
+
+
+def load(path):
+    rows, labels = [], []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            sentiment = item["sentiment"].strip().lower()
+            if sentiment in LABELS:
+                rows.append(features(tokenize(item["message"])))
+                labels.append(LABELS.index(sentiment))
+    return rows, np.array(labels)
+
+
+# Multinomial logistic regression on hashed features, trained with mini-batch SGD
+def train(rows, labels, epochs, lr, l2, batch_size=64, seed=0):
+    rng = np.random.default_rng(seed)
+    weights = np.zeros((len(LABELS), HASH_DIM), dtype=np.float32)
+    bias = np.zeros(len(LABELS), dtype=np.float32)
+    for epoch in range(epochs):
+        order = rng.permutation(len(rows))
+        loss = 0.0
+        for start in range(0, len(order), batch_size):
+            grad_w = {}
+            grad_b = np.zeros_like(bias)
+            for i in order[start:start + batch_size]:
+                scores = weights[:, rows[i]].sum(axis=1) + bias
+                probs = np.exp(scores - scores.max())
+                probs /= probs.sum()
+                loss -= np.log(probs[labels[i]] + 1e-12)
+                probs[labels[i]] -= 1
+                grad_b += probs
+                for feature in rows[i]:
+                    grad_w[feature] = grad_w.get(feature, 0) + probs
+            for feature, grad in grad_w.items():
+                weights[:, feature] -= lr * (grad + l2 * weights[:, feature])
+            bias -= lr * grad_b
+        print(f"epoch {epoch + 1}: loss {loss / len(rows):.4f}")
+    return weights, bias
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("data")
+    parser.add_argument("-o", "--output", default="Community/sentiment_model.npz")
+    parser.add_argument("--epochs", type=int, default=5)
+    parser.add_argument("--lr", type=float, default=0.1)
+    parser.add_argument("--l2", type=float, default=1e-4)
+    args = parser.parse_args()
+
+    rows, labels = load(args.data)
+    weights, bias = train(rows, labels, args.epochs, args.lr, args.l2)
+    predictions = [int(np.argmax(weights[:, row].sum(axis=1) + bias)) for row in rows]
+    print(f"training accuracy {np.mean(np.array(predictions) == labels):.3f}")
+    # float16 keeps the file compact, the precision loss does not matter for argmax
+    np.savez_compressed(args.output, weights=weights.astype(np.float16), bias=bias)
+
+
+if __name__ == "__main__":
+    main()
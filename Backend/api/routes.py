@@ -1,191 +1,113 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Response, Cookie, Body
-from fastapi.responses import JSONResponse
+from fastapi import APIRouter, Depends, HTTPException, status, Request, Response, Cookie, Body, Query
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.security import OAuth2PasswordRequestForm
-from auth.user_auth import register_user, login_for_access_token, collection, ACCESS_TOKEN_EXPIRE_MINUTES
-from auth.jwt import verify_token, Secret_key, algo
-from auth.user_schema import UserCreate, Token, Message, MessageSchema
-from Community.community import message_analysis, display_messages, update_DB
-from auth.jwt import oauth2, create_access_token
-from Chatbot.Chatbot_logic import get_chatbot_response, get_conversation_history
-from jose import JWTError, jwt
-from datetime import timedelta
-from pymongo import MongoClient
+from auth.user_auth import register_user, login_for_access_token, collection
+from auth.jwt import refresh_access_token
+from auth.dependencies import get_current_user, get_user, cached_verify_token
+from auth.auth_cache import invalidate_token
+from auth.hashing import hash_pool, HashingBusy
+from auth.bulk_import import import_users, read_rows, read_lines, BULK_IMPORT_USERS
+from auth.user_schema import UserCreate, Token, Message, MessageSchema, SearchRequest, BatchSearchRequest, LocationPing
+from Community.community import display_messages, now_ms, COMMUNITY_PAGE_SIZE
+from Community.moderation import moderator
+from Community.moderation_queue import moderation_queue, COMMUNITY_ASYNC_MODERATION
+from Community.feed import community_feed, publish_post, dumps as feed_dumps
+from realtime.connections import connection_manager, send_to_user
+from realtime.presence import presence_index, PRESENCE_AREA_PRECISION
+from search.nearby import find_nearby, find_nearby_page, SEARCH_RADIUS_M, SEARCH_MAX_RADIUS_M, SEARCH_PAGE_SIZE, SEARCH_MAX_PAGE_SIZE, SEARCH_MAX_BATCH
+from search.search_cache import search_cache
+from search.geo_index import geo_index
+from search.professions import profession_index
+from search.locations import location_buffer
+from llm.gateway import llm_gateway, LLMUnavailable
+from Chatbot.response_cache import response_cache
+from Chatbot.Chatbot_logic import get_chatbot_response, get_conversation_history, stream_chatbot_response, get_history_page
+from chat.messages import chat_key, save_message, get_page, CHAT_PAGE_SIZE
+from chat.summaries import record_message, mark_read, get_summaries, CHAT_HISTORY_PAGE_SIZE
+from database.db import AsyncCollection
 import json
-from datetime import datetime, timedelta
+from datetime import datetime
 import asyncio
 from fastapi.websockets import WebSocket
-import os
 
 router = APIRouter()
-active_connections = {}
-
-# connecting Mongo
-client = MongoClient(os.getenv('mongo'))
-db = client["Mini_Project"]
-community_coll = db["Community"]
-Chat = db["Chat"]
-user_info = db["User_Auth"]
-
 
+# Collections on the shared Mongo client
+community_coll = AsyncCollection("Community")
 
 # Register a new user
 @router.post("/register", status_code=201)
 async def register(user: UserCreate):
-    # existing_user = await collection.find_one({"username": user.username})
     # print(user)
-    existing_user = collection.find_one({"username": user.username})
+    existing_user = await collection.find_one({"username": user.username})
     if existing_user:
         raise HTTPException(status_code=400, detail="Username already exists")
     
-    new_user = await register_user(
-        user.username,
-        user.password,
-        user.dob,
-        user.profession,
-        user.address,
-        user.pincode,
-        user.contact_number,
-        user.email,
-        user.latitude,
-        user.longitude,)
+    try:
+        new_user = await register_user(
+            user.username,
+            user.password,
+            user.dob,
+            user.profession,
+            user.address,
+            user.pincode,
+            user.contact_number,
+            user.email,
+            user.latitude,
+            user.longitude,)
+    except HashingBusy as e:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(e), headers={"Retry-After": "1"})
 
     return {"message": "User registered successfully"}
 
 
+# Bulk registration from a streamed NDJSON or CSV body (one user per line, UserCreate fields),
+# for the users listed in BULK_IMPORT_USERS
+@router.post("/register/bulk")
+async def register_bulk(request: Request, fmt: str | None = Query(None, alias="format", pattern="^(ndjson|csv)$"), user: dict = Depends(get_current_user)):
+    if user['username'] not in BULK_IMPORT_USERS:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not allowed to import users")
+    fmt = fmt or ("csv" if "csv" in request.headers.get("content-type", "") else "ndjson")
+    report = await import_users(read_rows(read_lines(request.stream()), fmt))
+    return {"message": "Bulk import finished", **report.to_dict()}
+
+
 @router.get("/refresh")
 async def refresh_token(refresh_token: str = Cookie(None)):
-    if refresh_token is None : 
-        raise HTTPException(status_code=403, detail='Refresh token not found!!')
-    try:
-        payload = jwt.decode(refresh_token, Secret_key, algorithms=[algo])
-        username: str = payload.get("sub")
-        if username is None:
-            raise HTTPException(status_code=403, detail="Invalid refresh token")
-    except JWTError:
-        raise HTTPException(status_code=403, detail="refresh token expired, login Again!!")
-
     # Generate new access token
-    access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    new_access_token = create_access_token(data={"sub": username}, expires_delta=access_token_expires)
-
-    return new_access_token
+    return refresh_access_token(refresh_token)
 
 
 # User login and token generation
 @router.post("/token")
 async def login(response: Response, form_data: OAuth2PasswordRequestForm = Depends()):
-    return await login_for_access_token(response, form_data)
+    try:
+        return await login_for_access_token(response, form_data)
+    except HashingBusy as e:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(e), headers={"Retry-After": "1"})
 
 
 # Protected route example: Only accessible with valid token
 @router.get("/users/me")
-async def read_users_me(response:Response, access_token: str = Cookie(None)):
-    if not access_token:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Missing access token",
-            headers={"WWW-Authenticate": "Bearer"},
-        )
-    # print(f"Received token: {token}")
-    credentials_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
-    
-    if access_token.startswith("Bearer "):
-        access_token = access_token[len("Bearer "):]
-    
-    try:
-        username = verify_token(access_token, credentials_exception)
-    except HTTPException as e:
-        if e.status_code == 401 and "expired" in str(e.detail):
-            # Attempt to refresh the token
-            new_access_token = await refresh_token()
-            # Optionally, set the new access token in the cookies
-            response.set_cookie(key="access_token", value=f"Bearer {new_access_token}", httponly=True, secure=True, samesite='lax')
-            username = verify_token(new_access_token, credentials_exception) 
-        else:
-            raise e
-    user = collection.find_one({"username": username})
-    if not user:
-        raise credentials_exception
-    
+async def read_users_me(user: dict = Depends(get_current_user)):
     return {"message": 'Authenticated' }
 
 # Logout
 @router.post("/logout")
-async def logout(response: Response, access_token: str = Cookie(None)):
-    if not access_token:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Missing access token",
-            headers={"WWW-Authenticate": "Bearer"},
-        )
-    # print(f"Received token: {token}")
-    credentials_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
-    
-    if access_token.startswith("Bearer "):
-        access_token = access_token[len("Bearer "):]
-    
-    try:
-        username = verify_token(access_token, credentials_exception)
-    except HTTPException as e:
-        if e.status_code == 401 and "expired" in str(e.detail):
-            # Attempt to refresh the token
-            new_access_token = await refresh_token()
-            # Optionally, set the new access token in the cookies
-            response.set_cookie(key="access_token", value=f"Bearer {new_access_token}", httponly=True, secure=True, samesite='lax')
-            username = verify_token(new_access_token, credentials_exception) 
-        else:
-            raise e
-    user = collection.find_one({"username": username})
-    if not user:
-        raise credentials_exception
+async def logout(response: Response, access_token: str = Cookie(None), user: dict = Depends(get_current_user)):
 
     # Clear the access token cookie by setting it with an expired time
+    if access_token:
+        invalidate_token(access_token[len("Bearer "):] if access_token.startswith("Bearer ") else access_token)
     response.delete_cookie("access_token")
     
     return {"message": "Successfully logged out"}
 
 # Search 
+# online: "only" keeps the professionals connected right now, "first" ranks them ahead
 @router.post("/search")
-async def search(response:Response, query:str = Body(...), access_token: str = Cookie(None)):
+async def search(query:str = Body(...), online: str | None = Query(None, pattern="^(only|first)$"), user: dict = Depends(get_current_user)):
     query = query.lower()
-    if not access_token:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Missing access token",
-            headers={"WWW-Authenticate": "Bearer"},
-        )
-    # print(f"Received token: {token}")
-    credentials_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
-    
-    if access_token.startswith("Bearer "):
-        access_token = access_token[len("Bearer "):]
-    
-    try:
-        username = verify_token(access_token, credentials_exception)
-    except HTTPException as e:
-        if e.status_code == 401 and "expired" in str(e.detail):
-            # Attempt to refresh the token
-            new_access_token = await refresh_token()
-            # Optionally, set the new access token in the cookies
-            response.set_cookie(key="access_token", value=f"Bearer {new_access_token}", httponly=True, secure=True, samesite='lax')
-            username = verify_token(new_access_token, credentials_exception) 
-        else:
-            raise e
-    user = collection.find_one({"username": username})
-    if not user:
-        raise credentials_exception
     
     # Extract user's current location (latitude, longitude)
     user_location = user.get("location")
@@ -195,69 +117,168 @@ async def search(response:Response, query:str = Body(...), access_token: str = C
             detail="User location not found",
         )
     
-    # MongoDB query to search for professionals of the given profession near the current user
-    search_results = collection.find(
-        {
-            "profession": query,  
-            "location": {
-                "$nearSphere": {
-                    "$geometry": {
-                        "type": "Point",
-                        "coordinates": [user_location["coordinates"][0], user_location["coordinates"][1]]  
-                    },
-                    "$maxDistance": 5000  
-                }
-            }
-        }
-    )
-    
-# Collect and return the search results
-    results = []
-    for result in search_results:
-        results.append({
-            "username": result["username"],
-            "profession": result["profession"],
-            "location": result["location"],
-            "address": result["address"],
-            "contact_number": result["contact_number"],
-        })
+    # Search for professionals of the given profession near the current user
+    results = await find_nearby(query, user_location["coordinates"][0], user_location["coordinates"][1])
+    results = mark_online(results)
+    if online == "only":
+        results = [result for result in results if result["online"]]
+    elif online == "first":
+        # stable sort, so distance order is kept within each group
+        results.sort(key=lambda result: not result["online"])
     
     return {"message": "Search results", "data": results}
 
 
-# Community Chat 
-@router.post("/community")
-async def community(response:Response, message_data: Message, access_token: str = Cookie(None) ):
-    if not access_token:
+# Adding whether each professional is connected right now, from memory only
+def mark_online(results):
+    return [dict(result, online=presence_index.is_online(result["username"])) for result in results]
+
+
+# Paginated search: distance sorted results with a continuation cursor
+@router.post("/search/nearby")
+async def search_nearby(search_request: SearchRequest, user: dict = Depends(get_current_user)):
+    user_location = user.get("location")
+    if not user_location:
         raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Missing access token",
-            headers={"WWW-Authenticate": "Bearer"},
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="User location not found",
+        )
+    radius = search_request.radius or SEARCH_RADIUS_M
+    page_size = search_request.page_size or SEARCH_PAGE_SIZE
+    if not 0 < radius <= SEARCH_MAX_RADIUS_M or not 0 < page_size <= SEARCH_MAX_PAGE_SIZE:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"radius must be 1-{SEARCH_MAX_RADIUS_M} and page_size 1-{SEARCH_MAX_PAGE_SIZE}",
         )
-    # print(f"Received token: {token}")
-    credentials_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
-    
-    if access_token.startswith("Bearer "):
-        access_token = access_token[len("Bearer "):]
-    
     try:
-        username = verify_token(access_token, credentials_exception)
-    except HTTPException as e:
-        if e.status_code == 401 and "expired" in str(e.detail):
-            # Attempt to refresh the token
-            new_access_token = await refresh_token()
-            # Optionally, set the new access token in the cookies
-            response.set_cookie(key="access_token", value=f"Bearer {new_access_token}", httponly=True, secure=True, samesite='lax')
-            username = verify_token(new_access_token, credentials_exception) 
+        results, next_cursor = await find_nearby_page(
+            search_request.profession.lower(),
+            user_location["coordinates"][0],
+            user_location["coordinates"][1],
+            radius,
+            page_size,
+            search_request.cursor,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    results = mark_online(results)
+    if search_request.online_only:
+        # filtered after paging, a page may come back shorter than page_size
+        results = [result for result in results if result["online"]]
+    return {"message": "Search results", "data": results, "next_cursor": next_cursor}
+
+
+# Batch search: several professions / locations in one request
+@router.post("/search/batch")
+async def search_batch(batch: BatchSearchRequest, user: dict = Depends(get_current_user)):
+    if not 0 < len(batch.queries) <= SEARCH_MAX_BATCH:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"A batch must contain 1-{SEARCH_MAX_BATCH} queries",
+        )
+    user_location = user.get("location")
+    searches = []
+    for item in batch.queries:
+        if (item.latitude is None) != (item.longitude is None):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="latitude and longitude must be given together",
+            )
+        if item.latitude is not None:
+            lon, lat = item.longitude, item.latitude
+        elif user_location:
+            lon, lat = user_location["coordinates"][0], user_location["coordinates"][1]
         else:
-            raise e
-    user = collection.find_one({"username": username})
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="User location not found",
+            )
+        radius = item.radius or SEARCH_RADIUS_M
+        if not 0 < radius <= SEARCH_MAX_RADIUS_M:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"radius must be 1-{SEARCH_MAX_RADIUS_M}",
+            )
+        searches.append(find_nearby(item.profession.lower(), lon, lat, radius))
+
+    # Running every query at the same time
+    results = await asyncio.gather(*searches)
+    data = [
+        {"profession": item.profession.lower(), "data": mark_online(result)}
+        for item, result in zip(batch.queries, results)
+    ]
+    return {"message": "Search results", "data": data}
+
+
+# Profession autocomplete: completions and typo corrections for a partial query
+@router.get("/professions/autocomplete")
+async def profession_autocomplete(q: str = Query(...), limit: int = Query(10, ge=1, le=50)):
+    return {
+        "message": "Professions",
+        "data": profession_index.suggest(q, limit),
+        "canonical": profession_index.normalize(q),
+    }
+
+
+# Location ping from a moving professional, written to Mongo in the next batch
+@router.post("/location", status_code=202)
+async def location_ping(ping: LocationPing, user: dict = Depends(get_current_user)):
+    location_buffer.ping(user, ping.longitude, ping.latitude)
+    return {"success": True}
+
+
+# Location pings over a socket: {"latitude": ..., "longitude": ...} per message
+@router.websocket("/location/ws")
+async def location_ws(websocket: WebSocket, access_token: str = Cookie(None)):
+    try:
+        token = (access_token or "").removeprefix("Bearer ")
+        username = cached_verify_token(token, HTTPException(status_code=status.HTTP_401_UNAUTHORIZED))
+        user = await get_user(username)
+    except Exception:
+        user = None
     if not user:
-        raise credentials_exception
+        await websocket.close(code=1008)
+        return
+    await websocket.accept()
+    try:
+        while True:
+            try:
+                ping = LocationPing.model_validate_json(await websocket.receive_text())
+            except ValueError as e:
+                await websocket.send_text(json.dumps({"type": "error", "detail": str(e)}))
+                continue
+            location_buffer.ping(user, ping.longitude, ping.latitude)
+    except Exception as e:
+        print("Location socket closed:", e)
+
+
+# Professionals online right now per profession and per geohash area
+@router.get("/presence/counts")
+async def presence_counts(precision: int = Query(PRESENCE_AREA_PRECISION, ge=1, le=9), user: dict = Depends(get_current_user)):
+    return {"message": "Presence", "data": presence_index.counts(precision)}
+
+
+# Search cache and index counters
+@router.get("/metrics")
+async def metrics(user: dict = Depends(get_current_user)):
+    return {
+        "search_cache": search_cache.stats(),
+        "geo_index": {"ready": geo_index.ready, "professionals": len(geo_index)},
+        "moderation": moderator.stats(),
+        "moderation_queue": moderation_queue.stats(),
+        "community_feed": community_feed.stats(),
+        "realtime": connection_manager.stats(),
+        "locations": location_buffer.stats(),
+        "hashing": hash_pool.stats(),
+        "llm": llm_gateway.stats(),
+        "chatbot_cache": response_cache.stats() if response_cache else None,
+    }
+
+
+# Community Chat 
+@router.post("/community")
+async def community(message_data: Message, user: dict = Depends(get_current_user)):
+    username = user['username']
     
     # Validate the message
     if not message_data.message.strip():
@@ -265,7 +286,23 @@ async def community(response:Response, message_data: Message, access_token: str
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Message cannot be empty.",
         )
-    sentiment = message_analysis(message_data.message)
+    if COMMUNITY_ASYNC_MODERATION:
+        # Store the message as pending, a background worker moderates it
+        message_entry = {
+            "username": username,
+            "message": message_data.message,
+            # at the millisecond precision Mongo keeps, so the feed shows what is stored
+            "timestamp": now_ms(),
+            "status": "pending"
+        }
+        await community_coll.insert_one(message_entry)
+        await moderation_queue.submit(message_entry)
+        return {"message": message_data.message, "status": "pending", "success": True}
+
+    try:
+        sentiment = await moderator.classify(message_data.message)
+    except LLMUnavailable as e:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(e))
     # print(sentiment)
     if sentiment == "negative":
         raise HTTPException(
@@ -273,371 +310,223 @@ async def community(response:Response, message_data: Message, access_token: str
             detail="Follow the community guidelines. Negative messages are not allowed."
         )
     # Store Message in MongoDB
+    now = now_ms()
     message_entry = {
         "username": username,
         "message": message_data.message,
-        "timestamp": datetime.utcnow()
+        "timestamp": now,
+        "status": "published",
+        "published_at": now
     }
-    community_coll.insert_one(message_entry)
+    await community_coll.insert_one(message_entry)
+    await publish_post(message_entry)
     return  {"message": message_data.message, "sentiment": sentiment, "success": True}
 
 
 # Display Community Chat
 @router.get("/display_community")
-async def  community_load (response:Response, access_token: str = Cookie(None)):
-    if not access_token:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Missing access token",
-            headers={"WWW-Authenticate": "Bearer"},
-        )
-    # print(f"Received token: {token}")
-    credentials_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
-    
-    if access_token.startswith("Bearer "):
-        access_token = access_token[len("Bearer "):]
-    
+async def  community_load (since: str | None = None, before: str | None = None, limit: int = Query(COMMUNITY_PAGE_SIZE, ge=1, le=500), user: dict = Depends(get_current_user)):
+    # Display messages, old posts are removed by the TTL index
     try:
-        username = verify_token(access_token, credentials_exception)
-    except HTTPException as e:
-        if e.status_code == 401 and "expired" in str(e.detail):
-            # Attempt to refresh the token
-            new_access_token = await refresh_token()
-            # Optionally, set the new access token in the cookies
-            response.set_cookie(key="access_token", value=f"Bearer {new_access_token}", httponly=True, secure=True, samesite='lax')
-            username = verify_token(new_access_token, credentials_exception) 
-        else:
-            raise e
-    user = collection.find_one({"username": username})
-    if not user:
-        raise credentials_exception 
-    
-    # Update the Community DB
-    update_DB()
-    
-    # Display messages
-    community_dislpay_messages = display_messages()
+        community_dislpay_messages = await display_messages(since, before, limit)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
     return community_dislpay_messages
 
 
+# Recent community posts from memory, since/epoch come from the last post the client has
+@router.get("/community/feed")
+async def community_feed_get(since: int | None = Query(None, ge=0), epoch: int | None = None, limit: int = Query(COMMUNITY_PAGE_SIZE, ge=1, le=500), user: dict = Depends(get_current_user)):
+    posts = community_feed.since(since, epoch, limit)
+    reset = posts is None
+    if reset:
+        # the client's sequence is stale, send it the latest posts to reload from
+        posts = community_feed.since(None, limit=limit)
+    return {"posts": posts, "epoch": community_feed.epoch, "reset": reset}
+
+
+# Community posts pushed live, a reconnect passes the last seen since/epoch to get what it missed
+@router.websocket("/community/ws")
+async def community_ws(websocket: WebSocket, since: int | None = None, epoch: int | None = None, access_token: str = Cookie(None)):
+    try:
+        token = (access_token or "").removeprefix("Bearer ")
+        cached_verify_token(token, HTTPException(status_code=status.HTTP_401_UNAUTHORIZED))
+    except Exception:
+        await websocket.close(code=1008)
+        return
+    await websocket.accept()
+    # subscribing and reading the backlog together so no post falls in between
+    queue = community_feed.subscribe()
+    posts = community_feed.since(since, epoch)
+    reset = posts is None
+    if reset:
+        posts = community_feed.since(None, limit=COMMUNITY_PAGE_SIZE)
+    receiver = asyncio.ensure_future(websocket.receive_text())
+    try:
+        await websocket.send_text(feed_dumps({"type": "community_sync", "epoch": community_feed.epoch, "reset": reset, "posts": posts}))
+        while True:
+            getter = asyncio.ensure_future(queue.get())
+            done, _ = await asyncio.wait({getter, receiver}, return_when=asyncio.FIRST_COMPLETED)
+            # both may be done at once, a post already taken off the queue is still sent
+            if getter in done:
+                payload = getter.result()
+                if payload is None:
+                    # fell too far behind, the client reconnects from its last seq
+                    await websocket.close(code=1013)
+                    break
+                await websocket.send_text(payload)
+            else:
+                getter.cancel()
+            if receiver in done:
+                receiver.result()  # raises once the client disconnects
+                receiver = asyncio.ensure_future(websocket.receive_text())
+    except Exception as e:
+        print("Community feed closed:", e)
+    finally:
+        receiver.cancel()
+        community_feed.unsubscribe(queue)
+
+
 
 # Real time chat
 
 # 1. Fetch Chat History
 @router.get("/chat/{professional_username}")
-async def get_chat(response: Response, professional_username: str, access_token: str = Cookie(None)):
-    """Fetch chat history between logged-in user and the selected professional."""
-    if not access_token:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Missing access token",
-            headers={"WWW-Authenticate": "Bearer"},
-        )
-    # print(f"Received token: {token}")
-    credentials_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
-    
-    if access_token.startswith("Bearer "):
-        access_token = access_token[len("Bearer "):]
-    
+async def get_chat(professional_username: str, before: str | None = None, limit: int = Query(CHAT_PAGE_SIZE, ge=1, le=200), user: dict = Depends(get_current_user)):
+    """Fetch a page of the chat between logged-in user and the selected professional, pass next_before for older messages."""
+    username = user['username']
+
     try:
-        username = verify_token(access_token, credentials_exception)
-    except HTTPException as e:
-        if e.status_code == 401 and "expired" in str(e.detail):
-            # Attempt to refresh the token
-            new_access_token = await refresh_token()
-            # Optionally, set the new access token in the cookies
-            response.set_cookie(key="access_token", value=f"Bearer {new_access_token}", httponly=True, secure=True, samesite='lax')
-            username = verify_token(new_access_token, credentials_exception) 
+        if before:
+            messages, next_before = await get_page(chat_key(username, professional_username), before, limit)
         else:
-            raise e
-    user = collection.find_one({"username": username})
-    if not user:
-        raise credentials_exception
-
-    chat = Chat.find_one({"$or": [
-        {"user 1": username, "user 2": professional_username},
-        {"user 1": professional_username, "user 2": username}
-    ]})
-    
-    if chat:
-        return {"messages": chat["messages"]}
-    
-    return {"messages": []}  # Return empty if no chat history
+            # opening the chat reads its latest messages
+            (messages, next_before), _ = await asyncio.gather(
+                get_page(chat_key(username, professional_username), before, limit),
+                mark_read(username, professional_username),
+            )
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    return {"messages": messages, "next_before": next_before}
 
 
 # 2. Send Message
 @router.post("/chat/send")
-async def send_message(response: Response, message_data: MessageSchema, access_token: str = Cookie(None)):
+async def send_message(message_data: MessageSchema, user: dict = Depends(get_current_user)):
     """Send a message and update chat history."""
     
-    if not access_token:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Missing access token",
-            headers={"WWW-Authenticate": "Bearer"},
-        )
-    # print(f"Received token: {token}")
-    credentials_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
-    
-    if access_token.startswith("Bearer "):
-        access_token = access_token[len("Bearer "):]
-    
-    try:
-        username = verify_token(access_token, credentials_exception)
-    except HTTPException as e:
-        if e.status_code == 401 and "expired" in str(e.detail):
-            # Attempt to refresh the token
-            new_access_token = await refresh_token()
-            # Optionally, set the new access token in the cookies
-            response.set_cookie(key="access_token", value=f"Bearer {new_access_token}", httponly=True, secure=True, samesite='lax')
-            username = verify_token(new_access_token, credentials_exception) 
-        else:
-            raise e
-    user = collection.find_one({"username": username})
-    if not user:
-        raise credentials_exception
+    username = user['username']
 
-    chat = Chat.find_one({"$or": [
-        {"user 1": username, "user 2": message_data.receiver},
-        {"user 1": message_data.receiver, "user 2": username}
-    ]})
-    
     new_message = {
         "text": message_data.message,
         "timestamp": datetime.utcnow(),
         "sender": username
     }
 
-    if chat:
-        Chat.update_one({"_id": chat["_id"]}, {"$push": {"messages": new_message}, "$set": {"last_updated": datetime.utcnow()}})
-    else:
-        Chat.insert_one({
-            "user 1": username,
-            "user 2": message_data.receiver,
-            "messages": [new_message],
-            "last_updated": datetime.utcnow()
-        })
-    if message_data.receiver in active_connections:
-                await active_connections[message_data.receiver].send_text(
-                    json.dumps({"message": message_data.message, "sender": username, "receiver": message_data.receiver})
-                )    
+    await asyncio.gather(
+        save_message(username, message_data.receiver, new_message),
+        record_message(username, message_data.receiver, new_message),
+    )
+    await send_to_user(message_data.receiver, {"message": message_data.message, "sender": username, "receiver": message_data.receiver})
 
     return {"success": True, "message": "Message sent!"}
 
 
 # 3. Establish 1-1 Chat 
 @router.websocket("/chat/ws/{sender}")
-async def chat_ws(websocket: WebSocket, sender: str):
-    await websocket.accept()  # Accept the WebSocket connection
-    active_connections[sender] = websocket  # Store WebSocket connection for this receiver
+async def chat_ws(websocket: WebSocket, sender: str, access_token: str = Cookie(None)):
+    # Only the logged-in user may open their own socket
+    try:
+        token = (access_token or "").removeprefix("Bearer ")
+        username = cached_verify_token(token, HTTPException(status_code=status.HTTP_401_UNAUTHORIZED))
+        user = await get_user(username)
+    except Exception:
+        user = None
+    if not user or user['username'] != sender.lower():
+        await websocket.close(code=1008)
+        return
+    # Accept the WebSocket connection, each device of the user gets its own
+    connection = await connection_manager.connect(websocket, user['username'], user)
 
     try:
         while True:
             data = await websocket.receive_text()  # Receive data from client
+            connection_manager.touch(connection)  # any message, pongs included, keeps it alive
     except Exception as e:
         print("Error:", e)  # Print any exceptions that occur
     finally:
-        # Unregister the user when the WebSocket connection closes
-        active_connections.pop(sender, None)
-        await websocket.close()  # Close the WebSocket connection
+        # Unregister the socket when the WebSocket connection closes
+        await connection_manager.disconnect(connection)
 
 # Chatbot Api
 # To get the chat history of the user and the bot
 @router.get("/chat")
-async def chat_get(response:Response, access_token: str = Cookie(None)):
-    if not access_token:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Missing access token",
-            headers={"WWW-Authenticate": "Bearer"},
-        )
-    # print(f"Received token: {token}")
-    credentials_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
-    
-    if access_token.startswith("Bearer "):
-        access_token = access_token[len("Bearer "):]
-    
-    try:
-        username = verify_token(access_token, credentials_exception)
-    except HTTPException as e:
-        if e.status_code == 401 and "expired" in str(e.detail):
-            # Attempt to refresh the token
-            new_access_token = await refresh_token()
-            # Optionally, set the new access token in the cookies
-            response.set_cookie(key="access_token", value=f"Bearer {new_access_token}", httponly=True, secure=True, samesite='lax')
-            username = verify_token(new_access_token, credentials_exception) 
-        else:
-            raise e
-    user = collection.find_one({"username": username})
-    if not user:
-        raise credentials_exception
-    convo_log = get_conversation_history(user['username'])
+async def chat_get(user: dict = Depends(get_current_user)):
+    convo_log = await get_conversation_history(user['username'])
     return convo_log
 
+# To page through the full chatbot history, newest first
+@router.get("/chatbot/history")
+async def chatbot_history(before: int | None = Query(None, ge=1), limit: int = Query(20, ge=1, le=100), user: dict = Depends(get_current_user)):
+    turns, next_before = await get_history_page(user['username'], before, limit)
+    return {"message": "Chatbot history", "data": turns, "next_before": next_before}
+
 # To send the message to the bot and get the response
 @router.post("/chat")
-async def chat_post(response: Response, chat_request: Message, access_token: str = Cookie(None)):
-    if not access_token:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Missing access token",
-            headers={"WWW-Authenticate": "Bearer"},
-        )
-    # print(f"Received token: {token}")
-    credentials_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
-    
-    if access_token.startswith("Bearer "):
-        access_token = access_token[len("Bearer "):]
-    
-    try:
-        username = verify_token(access_token, credentials_exception)
-    except HTTPException as e:
-        if e.status_code == 401 and "expired" in str(e.detail):
-            # Attempt to refresh the token
-            new_access_token = await refresh_token()
-            # Optionally, set the new access token in the cookies
-            response.set_cookie(key="access_token", value=f"Bearer {new_access_token}", httponly=True, secure=True, samesite='lax')
-            username = verify_token(new_access_token, credentials_exception) 
-        else:
-            raise e
-    user = collection.find_one({"username": username})
-    # print('user details to be sent to chatbot logic backend',user['username'])
-    if not user:
-        raise credentials_exception
+async def chat_post(chat_request: Message, user: dict = Depends(get_current_user)):
     
     # Get the user message from the request body
     user_message = chat_request.message
     
     # Call the chatbot logic function
-    bot_response, convo_log = get_chatbot_response(user_message, user['username'])
+    try:
+        bot_response, convo_log = await get_chatbot_response(user_message, user['username'])
+    except LLMUnavailable as e:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(e))
     
     # Return the bot's response as JSON
     return JSONResponse(content={"bot response": bot_response}), convo_log
 
+# To stream the bot's response as server-sent events while it is generated
+@router.post("/chat/stream")
+async def chat_stream(chat_request: Message, user: dict = Depends(get_current_user)):
+    async def events():
+        chunks = []
+        try:
+            async for chunk in stream_chatbot_response(chat_request.message, user['username']):
+                chunks.append(chunk)
+                yield f"data: {json.dumps({'token': chunk})}\n\n"
+        except LLMUnavailable as e:
+            yield f"event: error\ndata: {json.dumps({'detail': str(e)})}\n\n"
+            return
+        yield f"event: done\ndata: {json.dumps({'bot response': ''.join(chunks)})}\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
 # Route to get professionals contacted in the past
 @router.get("/chat_history")
-async def read_users_me(response:Response, access_token: str = Cookie(None)):
-    if not access_token:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Missing access token",
-            headers={"WWW-Authenticate": "Bearer"},
-        )
-    # print(f"Received token: {token}")
-    credentials_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
-    
-    if access_token.startswith("Bearer "):
-        access_token = access_token[len("Bearer "):]
-    
+async def read_users_me(before: str | None = None, limit: int = Query(CHAT_HISTORY_PAGE_SIZE, ge=1, le=200), user: dict = Depends(get_current_user)):
+    # latest message received from every user, most recent chat first
     try:
-        username = verify_token(access_token, credentials_exception)
-    except HTTPException as e:
-        if e.status_code == 401 and "expired" in str(e.detail):
-            # Attempt to refresh the token
-            new_access_token = await refresh_token()
-            # Optionally, set the new access token in the cookies
-            response.set_cookie(key="access_token", value=f"Bearer {new_access_token}", httponly=True, secure=True, samesite='lax')
-            username = verify_token(new_access_token, credentials_exception) 
-        else:
-            raise e
-    user = collection.find_one({"username": username})
-    # print(user)
-    if not user:
-        raise credentials_exception
-    # fetching the opposite users from the chat collection
-    documents = Chat.find({
-    "$or": [
-        {"user 1": user['username']},
-        {"user 2": user['username']}
-            ]
-        })
-    
+        documents, next_before = await get_summaries(user['username'], before, limit)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
     latest_messages_by_sender = {}
-    # Get the opposite users from the chat collection
     for doc in documents:
-        for message in doc["messages"]:
-            sender = message["sender"]
-            if sender == user['username']:
-                continue
-            timestamp = message["timestamp"]
-            if sender not in latest_messages_by_sender or timestamp > latest_messages_by_sender[sender]["timestamp"]:
-                latest_messages_by_sender[sender] = {
-                "message_text": message["text"],
-                "sender": sender,
-                "timestamp": timestamp
-            }
+        latest_messages_by_sender[doc["counterpart"]] = {
+            "message_text": doc["message_text"],
+            "sender": doc["counterpart"],
+            "timestamp": doc["timestamp"],
+            "unread": doc.get("unread", 0)
+        }
 
-    return {"message": "Chat history", "data": latest_messages_by_sender}
+    return {"message": "Chat history", "data": latest_messages_by_sender, "next_before": next_before}
 
 # Route to get loggedin users info for profile screen
 @router.get("/user_profile")
-async def read_users_me(response:Response, access_token: str = Cookie(None)):
-    if not access_token:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Missing access token",
-            headers={"WWW-Authenticate": "Bearer"},
-        )
-    # print(f"Received token: {token}")
-    credentials_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
-    
-    if access_token.startswith("Bearer "):
-        access_token = access_token[len("Bearer "):]
-    
-    try:
-        username = verify_token(access_token, credentials_exception)
-    except HTTPException as e:
-        if e.status_code == 401 and "expired" in str(e.detail):
-            # Attempt to refresh the token
-            new_access_token = await refresh_token()
-            # Optionally, set the new access token in the cookies
-            response.set_cookie(key="access_token", value=f"Bearer {new_access_token}", httponly=True, secure=True, samesite='lax')
-            username = verify_token(new_access_token, credentials_exception) 
-        else:
-            raise e
-    user = collection.find_one({"username": username})
-    # print(user)
-    if not user:
-        raise credentials_exception
-    # fetching the user  data from the database
-    info =  user_info.find_one(
-            {"username": username},
-            {
-                "_id": 0,
-                "username": 1,
-                "email": 1,
-                "dob": 1,
-                "profession": 1,
-                "address": 1,
-                "pincode": 1
-            }
-        )
+async def read_users_me(user: dict = Depends(get_current_user)):
+    # picking the profile fields from the already loaded user document
+    profile_fields = ["username", "email", "dob", "profession", "address", "pincode"]
+    info = {field: user[field] for field in profile_fields if field in user}
     return {"message": "User profile", "data": info}
\ No newline at end of file
@@ -0,0 +1,25 @@
+from utils.cache import TTLCache
+import os
+from dotenv import load_dotenv
+load_dotenv()
+
+# Cache sizes and lifetimes (seconds) for decoded tokens and user records
+AUTH_TOKEN_CACHE_SIZE = int(os.getenv('AUTH_TOKEN_CACHE_SIZE', 10000))
+AUTH_TOKEN_CACHE_TTL = int(os.getenv('AUTH_TOKEN_CACHE_TTL', 300))
+AUTH_USER_CACHE_SIZE = int(os.getenv('AUTH_USER_CACHE_SIZE', 10000))
+AUTH_USER_CACHE_TTL = int(os.getenv('AUTH_USER_CACHE_TTL', 60))
+
+# access token -> username
+token_cache = TTLCache(maxsize=AUTH_TOKEN_CACHE_SIZE, ttl=AUTH_TOKEN_CACHE_TTL)
+# username -> user document
+user_cache = TTLCache(maxsize=AUTH_USER_CACHE_SIZE, ttl=AUTH_USER_CACHE_TTL)
+
+
+# Dropping a cached user record after the user document changes
+def invalidate_user(username: str):
+    user_cache.pop(username)
+
+
+# Dropping a token from the cache (on logout)
+def invalidate_token(token: str):
+    token_cache.pop(token)
@@ -0,0 +1,190 @@
+from pydantic import ValidationError
+from pymongo.errors import BulkWriteError
+from .user_schema import UserCreate
+from .user_auth import collection, build_user_doc, index_new_users
+from .hashing import hash_pool
+from collections import deque
+import codecs
+import csv
+import json
+import os
+from dotenv import load_dotenv
+load_dotenv()
+
+# Rows validated, hashed and inserted together
+BULK_IMPORT_BATCH = int(os.getenv('BULK_IMPORT_BATCH', 500))
+# Row errors listed in the report, the rest are only counted
+BULK_IMPORT_MAX_ERRORS = int(os.getenv('BULK_IMPORT_MAX_ERRORS', 1000))
+# Users allowed to call /register/bulk, comma separated
+BULK_IMPORT_USERS = {name.strip().lower() for name in os.getenv('BULK_IMPORT_USERS', '').split(',') if name.strip()}
+
+
+# Splitting a stream of byte chunks into text lines
+async def read_lines(chunks):
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    buffer = ""
+    async for chunk in chunks:
+        buffer += decoder.decode(chunk)
+        *lines, buffer = buffer.split("\n")
+        for line in lines:
+            yield line.rstrip("\r")
+    buffer += decoder.decode(b"", final=True)
+    if buffer:
+        yield buffer.rstrip("\r")
+
+
+class _PendingLines:
+    """Lines handed to the csv reader, one complete record at a time."""
+
+    def __init__(self):
+        self.lines = deque()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if not self.lines:
+            raise StopIteration
+        return self.lines.popleft()
+
+
+# Rows of an NDJSON or CSV stream as (row number, fields or error message)
+async def read_rows(lines, fmt="ndjson"):
+    if fmt == "csv":
+        async for number, row in _read_csv_rows(lines):
+            yield number, row
+        return
+    number = 0
+    async for line in lines:
+        if not line.strip():
+            continue
+        number += 1
+        try:
+            row = json.loads(line)
+            if not isinstance(row, dict):
+                raise ValueError("each line must be a JSON object")
+            # numbers (coordinates, pincodes) are stored as strings like /register takes them
+            row = {key: str(value) if isinstance(value, (int, float)) else value for key, value in row.items()}
+        except ValueError as e:
+            yield number, str(e)
+            continue
+        yield number, row
+
+
+# All the lines go through one csv reader, so a quoted field may span lines.
+# Lines are gathered until their quotes balance and then read as one record
+async def _read_csv_rows(lines):
+    pending = _PendingLines()
+    reader = csv.reader(pending)
+    record = []
+    quotes = 0
+    header = None
+    number = 0
+    async for line in lines:
+        if not record and not line.strip():
+            continue
+        record.append(line + "\n")
+        quotes += line.count('"')
+        if quotes % 2:
+            continue
+        pending.lines.extend(record)
+        record, quotes = [], 0
+        try:
+            values = next(reader)
+        except csv.Error as e:
+            values = e
+        if header is None:
+            header = [name.strip() for name in values] if isinstance(values, list) else []
+            continue
+        number += 1
+        if isinstance(values, csv.Error):
+            yield number, str(values)
+        elif len(values) != len(header):
+            yield number, f"expected {len(header)} columns, got {len(values)}"
+        else:
+            yield number, dict(zip(header, values))
+    if record:
+        yield number + 1, "unterminated quoted field at the end of the file"
+
+
+class ImportReport:
+    """Outcome of a bulk import: counts and the first errors by row."""
+
+    def __init__(self):
+        self.rows = 0
+        self.inserted = 0
+        self.failed = 0
+        self.errors = []
+
+    def error(self, row, message):
+        self.failed += 1
+        if len(self.errors) < BULK_IMPORT_MAX_ERRORS:
+            self.errors.append({"row": row, "error": message})
+
+    def to_dict(self):
+        return {"rows": self.rows, "inserted": self.inserted, "failed": self.failed, "errors": self.errors}
+
+
+# Importing the users of a row stream, BULK_IMPORT_BATCH rows at a time
+async def import_users(rows, batch_size=BULK_IMPORT_BATCH):
+    report = ImportReport()
+    batch = []
+    async for number, row in rows:
+        report.rows += 1
+        if isinstance(row, str):
+            report.error(number, row)
+            continue
+        try:
+            user = UserCreate(**row)
+        except ValidationError as e:
+            report.error(number, "; ".join(f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors()))
+            continue
+        try:
+            float(user.latitude)
+            float(user.longitude)
+        except ValueError:
+            report.error(number, "latitude and longitude must be numbers")
+            continue
+        batch.append((number, user))
+        if len(batch) >= batch_size:
+            await _import_batch(batch, report)
+            batch = []
+    if batch:
+        await _import_batch(batch, report)
+    return report
+
+
+async def _import_batch(batch, report):
+    # usernames repeated in the batch or already registered
+    unique = {}
+    for number, user in batch:
+        username = user.username.lower()
+        if username in unique:
+            report.error(number, f"Duplicate username {username} in the import")
+        else:
+            unique[username] = (number, user)
+    existing = set(await collection.distinct("username", {"username": {"$in": list(unique)}}))
+    for username in existing:
+        number, user = unique.pop(username)
+        report.error(number, "Username already exists")
+    if not unique:
+        return
+
+    entries = list(unique.values())
+    hashes = await hash_pool.hash_many([user.password.lower() for number, user in entries])
+    docs = [
+        build_user_doc(user.username, hashed_password, user.dob, user.profession, user.address,
+                       user.pincode, user.contact_number, user.email, user.latitude, user.longitude)
+        for (number, user), hashed_password in zip(entries, hashes)
+    ]
+    failed = set()
+    try:
+        await collection.insert_many(docs, ordered=False)
+    except BulkWriteError as e:
+        for write_error in e.details.get("writeErrors", []):
+            failed.add(write_error["index"])
+            report.error(entries[write_error["index"]][0], write_error.get("errmsg", "Insert failed"))
+    inserted = [doc for index, doc in enumerate(docs) if index not in failed]
+    if inserted:
+        await index_new_users(inserted)
+    report.inserted += len(inserted)
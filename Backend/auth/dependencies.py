@@ -0,0 +1,63 @@
+from fastapi import HTTPException, Response, Cookie, status
+from .jwt import verify_token, token_expiry, refresh_access_token
+from .auth_cache import token_cache, user_cache
+from .user_auth import collection
+import time
+
+
+# Resolving a token to its username, decoding it only on a cache miss
+def cached_verify_token(token: str, credentials_exception):
+    username = token_cache.get(token)
+    if username is not None:
+        return username
+    username = verify_token(token, credentials_exception)
+    # never keep a token in the cache past its own expiry
+    expires_at = token_expiry(token)
+    ttl = token_cache.ttl if expires_at is None else min(token_cache.ttl, expires_at - time.time())
+    if ttl > 0:
+        token_cache.set(token, username, ttl=ttl)
+    return username
+
+
+# Fetching a user document, going to Mongo only on a cache miss
+async def get_user(username: str):
+    user = user_cache.get(username)
+    if user is not None:
+        return user
+    user = await collection.find_one({"username": username})
+    if user:
+        user_cache.set(username, user)
+    return user
+
+
+# Dependency shared by every protected route: returns the logged in user's document
+async def get_current_user(response: Response, access_token: str = Cookie(None), refresh_token: str = Cookie(None)):
+    if not access_token:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Missing access token",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    credentials_exception = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Could not validate credentials",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+
+    if access_token.startswith("Bearer "):
+        access_token = access_token[len("Bearer "):]
+
+    try:
+        username = cached_verify_token(access_token, credentials_exception)
+    except HTTPException as e:
+        if e.status_code == 401 and "expired" in str(e.detail):
+            # Attempt to refresh the token and set the new one in the cookies
+            new_access_token = refresh_access_token(refresh_token)
+            response.set_cookie(key="access_token", value=f"Bearer {new_access_token}", httponly=True, secure=True, samesite='lax')
+            username = cached_verify_token(new_access_token, credentials_exception)
+        else:
+            raise e
+    user = await get_user(username)
+    if not user:
+        raise credentials_exception
+    return user
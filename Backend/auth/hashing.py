@@ -0,0 +1,117 @@
+from concurrent.futures import ProcessPoolExecutor
+from passlib.context import CryptContext
+import asyncio
+import multiprocessing
+import hashlib
+import hmac
+import re
+import os
+from dotenv import load_dotenv
+load_dotenv()
+
+# Processes doing the bcrypt work, and how many hashes may wait for them
+# before new logins and registrations are turned away
+HASH_WORKERS = int(os.getenv('HASH_WORKERS', os.cpu_count() or 2))
+HASH_MAX_PENDING = int(os.getenv('HASH_MAX_PENDING', HASH_WORKERS * 16))
+# Key of the contact number HMAC. Required and kept apart from the JWT
+# secret: rotating that must not orphan every stored digest
+CONTACT_HASH_KEY = os.getenv('CONTACT_HASH_KEY')
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+
+# Run inside the pool processes
+def _hash(password):
+    return pwd_context.hash(password)
+
+
+def _verify(plain_password, hashed_password):
+    return pwd_context.verify(plain_password, hashed_password)
+
+
+class HashingBusy(RuntimeError):
+    """Raised when too many hashes are already waiting for the pool."""
+
+
+class HashPool:
+    """bcrypt hashing and verification on a pool of processes.
+
+    bcrypt takes a few hundred milliseconds of CPU per call; done on the
+    event loop it stalls every other request, so it runs here across cores.
+    Past max_pending waiting calls new ones fail straight away with
+    HashingBusy instead of queueing behind a login storm.
+    """
+
+    def __init__(self, workers=HASH_WORKERS, max_pending=HASH_MAX_PENDING):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.executor = None
+        self.pending = 0
+        self.completed = 0
+        self.rejected = 0
+
+    def _executor(self):
+        if self.executor is None:
+            # spawned rather than forked, the server already runs threads
+            self.executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+        return self.executor
+
+    async def _run(self, func, *args):
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise HashingBusy("Too many logins in progress, try again shortly")
+        self.pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor(), func, *args)
+        finally:
+            self.pending -= 1
+            self.completed += 1
+
+    async def hash(self, password: str):
+        return await self._run(_hash, password)
+
+    async def verify(self, plain_password: str, hashed_password: str):
+        return await self._run(_verify, plain_password, hashed_password)
+
+    # Hashing a batch of passwords across every process. Sent a wave of one
+    # per process at a time, so logins queued meanwhile don't wait behind the
+    # whole batch; not counted against max_pending, the caller waits instead
+    async def hash_many(self, passwords):
+        loop = asyncio.get_running_loop()
+        hashes = []
+        for start in range(0, len(passwords), self.workers):
+            wave = passwords[start:start + self.workers]
+            hashes += await asyncio.gather(*[loop.run_in_executor(self._executor(), _hash, password) for password in wave])
+            self.completed += len(wave)
+        return hashes
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+    def stats(self):
+        return {
+            "workers": self.workers,
+            "pending": self.pending,
+            "max_pending": self.max_pending,
+            "completed": self.completed,
+            "rejected": self.rejected,
+        }
+
+
+hash_pool = HashPool()
+
+
+# Called on startup so a missing key stops the server before any user is stored
+def require_contact_hash_key():
+    if not CONTACT_HASH_KEY:
+        raise RuntimeError("CONTACT_HASH_KEY is not set, contact numbers can't be hashed without it")
+
+
+# Keyed digest of a contact number: the same number always gives the same
+# digest, so it can be looked up, but it can't be reversed without the key
+def contact_digest(contact_number: str):
+    require_contact_hash_key()
+    normalized = re.sub(r"[^\d+]", "", contact_number)
+    return hmac.new(CONTACT_HASH_KEY.encode(), normalized.encode(), hashlib.sha256).hexdigest()
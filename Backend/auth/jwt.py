@@ -38,4 +38,22 @@ def verify_token(token: str, credentials_exception):
     except JWTError as e:
         if "expired" in str(e):
             raise HTTPException(status_code=401, detail="Access token has expired.")
-        raise credentials_exception
\ No newline at end of file
+        raise credentials_exception
+
+# Reading the expiry (unix time) of a token that has already been verified
+def token_expiry(token: str):
+    return jwt.get_unverified_claims(token).get("exp")
+
+
+# Issuing a new access token from a refresh token
+def refresh_access_token(refresh_token: Optional[str]):
+    if refresh_token is None :
+        raise HTTPException(status_code=403, detail='Refresh token not found!!')
+    try:
+        payload = jwt.decode(refresh_token, Secret_key, algorithms=[algo])
+        username: str = payload.get("sub")
+        if username is None:
+            raise HTTPException(status_code=403, detail="Invalid refresh token")
+    except JWTError:
+        raise HTTPException(status_code=403, detail="refresh token expired, login Again!!")
+    return create_access_token(data={"sub": username}, expires_delta=timedelta(minutes=Access_token_expire_minutes))
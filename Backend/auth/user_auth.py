@@ -1,10 +1,15 @@
-from passlib.context import CryptContext
 from fastapi import Depends, HTTPException, Response
-from pymongo import MongoClient, GEOSPHERE
 from fastapi.security import OAuth2PasswordRequestForm
 from .jwt import create_access_token
+from .auth_cache import invalidate_user
+from .hashing import hash_pool, contact_digest
+from database.db import AsyncCollection
+from realtime.connections import connection_manager
+from search.geo_index import geo_index, RESULT_FIELDS
+from search.search_cache import search_cache
+from search.professions import profession_index
+from collections import defaultdict
 from datetime import timedelta
-import os
 from dotenv import load_dotenv
 load_dotenv()
 
@@ -12,49 +17,45 @@ load_dotenv()
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 REFRESH_TOKEN_EXPIRE_MINUTES = 525600
 
-# connecting Mongo
-client = MongoClient(os.getenv('mongo'))
-db = client["Mini_Project"]
-collection = db["User_Auth"]
-collection.create_index([("location", "2dsphere")])
+# User collection on the shared Mongo client
+collection = AsyncCollection("User_Auth")
 
 
-# hashing password
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Creating the indexes used by the user queries
+async def ensure_indexes():
+    await collection.create_index([("location", "2dsphere")])
 
-def hash_password(password : str):
+
+# hashing password, on the hashing processes
+async def hash_password(password : str):
     password = password.lower()
-    return pwd_context.hash(password)
+    return await hash_pool.hash(password)
 
 # verifying passwords
-def verify_password(plain_password:str, hashed_password:str):
+async def verify_password(plain_password:str, hashed_password:str):
     plain_password = plain_password.lower()
-    return pwd_context.verify(plain_password, hashed_password)
+    return await hash_pool.verify(plain_password, hashed_password)
 
 # authenticate user
 async def authenticate_user (username : str, password : str) :
     username = username.lower()
     password = password.lower()
-    # user = await collection.find_one({'username':username})
-    user = collection.find_one({'username':username})
+    user = await collection.find_one({'username':username})
     # print(user)
-    if user and verify_password(password, user['hashed_password']) :
+    if user and await verify_password(password, user['hashed_password']) :
         return user
     return None
 
-# register user
-async def register_user (username : str, password : str, dob: str, profession: str, address: str, pincode: str, contact_number: str, email: str, latitude: str, longitude: str) :
-    hashed_password = hash_password(password)
-    hashed_contact = hash_password(contact_number)
+# Building the User_Auth document of a new user from the already hashed password
+def build_user_doc (username : str, hashed_password : str, dob: str, profession: str, address: str, pincode: str, contact_number: str, email: str, latitude: str, longitude: str) :
+    hashed_contact = contact_digest(contact_number)
     lat = float(latitude)
     lon = float(longitude)
     username = username.lower()
-    password = password.lower()
     profession = profession.lower()
     address = address.lower()
     email = email.lower()
-    # user = await collection.insert_one({'username':username, 'hashed_password':hashed_password})
-    user = collection.insert_one({'username':username,
+    user_doc = {'username':username,
                                 'hashed_password':hashed_password,
                                 'dob': dob,
                                 'profession': profession,
@@ -66,7 +67,33 @@ async def register_user (username : str, password : str, dob: str, profession: s
                                     "type": "Point",
                                     "coordinates": [lon, lat]  
                                             }
-                                })
+                                }
+    return user_doc
+
+# keeping the cached users, in-memory search index and cached searches of every worker in sync with new users
+async def index_new_users (user_docs : list) :
+    users = [{field: user_doc.get(field) for field in RESULT_FIELDS} for user_doc in user_docs]
+    await connection_manager.publish("new_users", users=users)
+
+def _apply_new_users (message : dict) :
+    points = defaultdict(list)
+    for user in message['users']:
+        invalidate_user(user['username'])
+        if geo_index.ready:
+            geo_index.upsert(user)
+        points[user['profession']].append(tuple(user['location']['coordinates']))
+        profession_index.add(user['profession'])
+    for profession, locations in points.items():
+        search_cache.invalidate_many(profession, locations)
+
+connection_manager.on("new_users", _apply_new_users)
+
+# register user
+async def register_user (username : str, password : str, dob: str, profession: str, address: str, pincode: str, contact_number: str, email: str, latitude: str, longitude: str) :
+    hashed_password = await hash_password(password)
+    user_doc = build_user_doc(username, hashed_password, dob, profession, address, pincode, contact_number, email, latitude, longitude)
+    user = await collection.insert_one(user_doc)
+    await index_new_users([user_doc])
     return user
 
 
@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from datetime import datetime 
 
 
@@ -26,6 +26,30 @@ class Token(BaseModel):
 class TokenData(BaseModel):
     username: str | None = None
 
+# Schema for the paginated nearby search
+class SearchRequest(BaseModel):
+    profession: str
+    radius: int | None = None
+    page_size: int | None = None
+    cursor: str | None = None
+    online_only: bool = False
+
+# Schema for a location ping from a moving professional
+class LocationPing(BaseModel):
+    latitude: float = Field(ge=-90, le=90)
+    longitude: float = Field(ge=-180, le=180)
+
+# Schema for one query of a batch search, the location defaults to the user's own
+class BatchSearchQuery(BaseModel):
+    profession: str
+    latitude: float | None = Field(None, ge=-90, le=90)
+    longitude: float | None = Field(None, ge=-180, le=180)
+    radius: int | None = None
+
+# Schema for the batch search
+class BatchSearchRequest(BaseModel):
+    queries: list[BatchSearchQuery]
+
 # Schema for the community messages
 class Message(BaseModel):
     message: str
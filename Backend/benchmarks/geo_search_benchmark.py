@@ -0,0 +1,124 @@
+"""Compare the in-memory GeoIndex against the Mongo $nearSphere search.
+
+Run from the Backend directory:
+
+    python -m benchmarks.geo_search_benchmark --sizes 10000 100000 1000000 --mongo
+
+Professionals are generated uniformly around a city centre. With --mongo they
+are also written to a scratch collection (dropped afterwards) so the same
+queries can be timed against $nearSphere.
+"""
+import argparse
+import random
+import time
+import numpy as np
+from search.geo_index import GeoIndex, METERS_PER_DEG_LAT
+
+CENTER_LON, CENTER_LAT = 72.8777, 19.0760
+SPREAD_DEG = 0.5
+PROFESSIONS = ["plumber", "electrician", "tutor", "doctor", "carpenter",
+               "painter", "mechanic", "lawyer", "nurse", "chef"]
+
+
+def make_professionals(n, rng):
+    lons = CENTER_LON + rng.uniform(-SPREAD_DEG, SPREAD_DEG, n)
+    lats = CENTER_LAT + rng.uniform(-SPREAD_DEG, SPREAD_DEG, n)
+    professions = rng.choice(PROFESSIONS, n)
+    return [
+        {
+            "username": f"bench{i}",
+            "profession": str(professions[i]),
+            "address": "",
+            "contact_number": "",
+            "location": {"type": "Point", "coordinates": [float(lons[i]), float(lats[i])]},
+        }
+        for i in range(n)
+    ]
+
+
+def make_queries(count, rng):
+    return [
+        (random.choice(PROFESSIONS),
+         float(CENTER_LON + rng.uniform(-SPREAD_DEG, SPREAD_DEG)),
+         float(CENTER_LAT + rng.uniform(-SPREAD_DEG, SPREAD_DEG)))
+        for _ in range(count)
+    ]
+
+
+def timed(run, queries):
+    latencies = []
+    total = 0
+    for query in queries:
+        start = time.perf_counter()
+        total += run(*query)
+        latencies.append((time.perf_counter() - start) * 1000)
+    latencies = np.array(latencies)
+    return {"p50_ms": np.percentile(latencies, 50), "p99_ms": np.percentile(latencies, 99),
+            "avg_hits": total / len(queries)}
+
+
+def report(name, result):
+    print(f"  {name:<22} p50 {result['p50_ms']:8.3f} ms   p99 {result['p99_ms']:8.3f} ms   avg hits {result['avg_hits']:8.1f}")
+
+
+def bench_index(professionals, queries, radius_m, k):
+    index = GeoIndex()
+    start = time.perf_counter()
+    for professional in professionals:
+        index.upsert(professional)
+    print(f"  index build             {time.perf_counter() - start:8.2f} s")
+    report("index radius", timed(lambda p, lon, lat: len(index.radius(p, lon, lat, radius_m)), queries))
+    report(f"index {k}-nearest", timed(lambda p, lon, lat: len(index.nearest(p, lon, lat, k)), queries))
+
+
+def bench_mongo(professionals, queries, radius_m, k):
+    from pymongo import GEOSPHERE
+    from database.db import get_db, close_client
+    coll = get_db()["Geo_benchmark"]
+    coll.drop()
+    try:
+        start = time.perf_counter()
+        for offset in range(0, len(professionals), 10000):
+            coll.insert_many([dict(doc) for doc in professionals[offset:offset + 10000]], ordered=False)
+        coll.create_index([("location", GEOSPHERE)])
+        print(f"  mongo load + index      {time.perf_counter() - start:8.2f} s")
+
+        def near(profession, lon, lat, max_distance=radius_m, limit=0):
+            return len(list(coll.find({
+                "profession": profession,
+                "location": {"$nearSphere": {
+                    "$geometry": {"type": "Point", "coordinates": [lon, lat]},
+                    "$maxDistance": max_distance,
+                }},
+            }, limit=limit)))
+
+        report("mongo $nearSphere", timed(near, queries))
+        report(f"mongo {k}-nearest", timed(
+            lambda p, lon, lat: near(p, lon, lat, max_distance=4 * SPREAD_DEG * METERS_PER_DEG_LAT, limit=k), queries))
+    finally:
+        coll.drop()
+        close_client()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000])
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--radius", type=int, default=5000)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--mongo", action="store_true", help="also time $nearSphere (needs the mongo env var)")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(42)
+    random.seed(42)
+    queries = make_queries(args.queries, rng)
+    for size in args.sizes:
+        print(f"{size} professionals")
+        professionals = make_professionals(size, rng)
+        bench_index(professionals, queries, args.radius, args.k)
+        if args.mongo:
+            bench_mongo(professionals, queries, args.radius, args.k)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+from datetime import datetime
+from pymongo.errors import DuplicateKeyError
+from database.db import AsyncCollection
+import json
+from dotenv import load_dotenv
+import os
+load_dotenv()
+
+# Length of the time window whose messages share one bucket document
+CHAT_BUCKET_SECONDS = int(os.getenv('CHAT_BUCKET_SECONDS', 3600))
+CHAT_PAGE_SIZE = int(os.getenv('CHAT_PAGE_SIZE', 50))
+# Buckets read per round trip while filling a page
+CHAT_PAGE_BUCKETS = int(os.getenv('CHAT_PAGE_BUCKETS', 4))
+
+# Messages of every pair of users in time buckets. The old Chat collection
+# with one document per pair is only read by the migration in manage.py
+Chat = AsyncCollection("Chat")
+buckets = AsyncCollection("Chat_buckets")
+
+
+async def ensure_indexes():
+    await buckets.create_index([("chat_id", 1), ("bucket", -1)], unique=True)
+    await buckets.create_index("participants")
+
+
+# The same id for a pair of users whoever sends: the JSON of their sorted usernames
+def chat_key(username: str, other: str):
+    return json.dumps(sorted([username, other]))
+
+
+def bucket_of(timestamp: datetime):
+    return int((timestamp - datetime(1970, 1, 1)).total_seconds()) // CHAT_BUCKET_SECONDS
+
+
+# Appending a message to the bucket of its time window in one upsert
+async def save_message(username: str, other: str, message: dict):
+    query = {"chat_id": chat_key(username, other), "bucket": bucket_of(message["timestamp"])}
+    update = {
+        "$push": {"messages": message},
+        "$inc": {"count": 1},
+        "$set": {"last_updated": message["timestamp"]},
+        "$setOnInsert": {"participants": sorted([username, other])},
+    }
+    try:
+        await buckets.update_one(query, update, upsert=True)
+    except DuplicateKeyError:
+        # another send created the bucket first, it now matches
+        await buckets.update_one(query, update)
+
+
+# Cursors point just past the oldest message of the page: "<bucket>_<index in bucket>"
+def encode_cursor(bucket: int, index: int):
+    return f"{bucket}_{index}"
+
+
+def decode_cursor(cursor: str):
+    try:
+        bucket, index = cursor.split("_")
+        return int(bucket), int(index)
+    except ValueError:
+        raise ValueError("Invalid cursor")
+
+
+# A page of messages, oldest first, ending just before the cursor (the latest page without one).
+# Returns the messages and the cursor of the next older page, None at the start of the chat.
+async def get_page(chat_id: str, before: str = None, limit: int = CHAT_PAGE_SIZE):
+    query = {"chat_id": chat_id}
+    bucket = end = None
+    if before:
+        bucket, end = decode_cursor(before)
+        query["bucket"] = {"$lte": bucket}
+    page = []
+    while True:
+        documents = await buckets.find(query, {"_id": 0, "bucket": 1, "messages": 1}, sort=[("bucket", -1)], limit=CHAT_PAGE_BUCKETS)
+        for document in documents:
+            messages = document["messages"]
+            stop = end if document["bucket"] == bucket else len(messages)
+            start = max(0, stop - (limit - len(page)))
+            page[:0] = messages[start:stop]
+            if len(page) == limit:
+                return page, encode_cursor(document["bucket"], start)
+        if len(documents) < CHAT_PAGE_BUCKETS:
+            return page, None
+        query["bucket"] = {"$lt": documents[-1]["bucket"]}
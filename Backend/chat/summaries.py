@@ -0,0 +1,61 @@
+from datetime import datetime, timedelta
+from bson import ObjectId
+from bson.errors import InvalidId
+from database.db import AsyncCollection
+from dotenv import load_dotenv
+import os
+load_dotenv()
+
+CHAT_HISTORY_PAGE_SIZE = int(os.getenv('CHAT_HISTORY_PAGE_SIZE', 50))
+
+# One document per user and counterpart with the last message received from
+# the counterpart and how many of their messages are unread
+summaries = AsyncCollection("Chat_summaries")
+
+
+async def ensure_indexes():
+    await summaries.create_index([("owner", 1), ("counterpart", 1)], unique=True)
+    await summaries.create_index([("owner", 1), ("timestamp", -1), ("_id", -1)])
+
+
+# Recording a message on the receiver's summary of the chat with its sender
+async def record_message(sender: str, receiver: str, message: dict):
+    await summaries.update_one(
+        {"owner": receiver, "counterpart": sender},
+        {"$set": {"message_text": message["text"], "timestamp": message["timestamp"]}, "$inc": {"unread": 1}},
+        upsert=True,
+    )
+
+
+# The owner has read the chat with the counterpart
+async def mark_read(owner: str, counterpart: str):
+    await summaries.update_one({"owner": owner, "counterpart": counterpart, "unread": {"$gt": 0}}, {"$set": {"unread": 0}})
+
+
+# Cursors point at the last summary of a page: "<timestamp in ms>_<id>"
+def encode_cursor(summary):
+    millis = int((summary["timestamp"] - datetime(1970, 1, 1)).total_seconds() * 1000)
+    return f"{millis}_{summary['_id']}"
+
+
+def decode_cursor(cursor: str):
+    try:
+        millis, summary_id = cursor.split("_", 1)
+        return datetime(1970, 1, 1) + timedelta(milliseconds=int(millis)), ObjectId(summary_id)
+    except (ValueError, InvalidId):
+        raise ValueError("Invalid cursor")
+
+
+# The owner's chats, most recent message first. Returns the summaries and the
+# cursor of the next page, None on the last page
+async def get_summaries(owner: str, before: str = None, limit: int = CHAT_HISTORY_PAGE_SIZE):
+    query = {"owner": owner}
+    if before:
+        timestamp, summary_id = decode_cursor(before)
+        query["$or"] = [
+            {"timestamp": {"$lt": timestamp}},
+            {"timestamp": timestamp, "_id": {"$lt": summary_id}},
+        ]
+    documents = await summaries.find(query, sort=[("timestamp", -1), ("_id", -1)], limit=limit + 1)
+    next_before = encode_cursor(documents[limit - 1]) if len(documents) > limit else None
+    return documents[:limit], next_before
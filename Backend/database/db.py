@@ -0,0 +1,134 @@
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from pymongo import MongoClient
+import threading
+import asyncio
+import os
+from dotenv import load_dotenv
+load_dotenv()
+
+# Mongo connection settings
+MONGO_URL = os.getenv('mongo')
+MONGO_DB_NAME = os.getenv('MONGO_DB_NAME', 'Mini_Project')
+MONGO_MAX_POOL_SIZE = int(os.getenv('MONGO_MAX_POOL_SIZE', 50))
+MONGO_MIN_POOL_SIZE = int(os.getenv('MONGO_MIN_POOL_SIZE', 0))
+MONGO_MAX_IDLE_TIME_MS = int(os.getenv('MONGO_MAX_IDLE_TIME_MS', 60000))
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv('MONGO_CONNECT_TIMEOUT_MS', 10000))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv('MONGO_SERVER_SELECTION_TIMEOUT_MS', 10000))
+MONGO_SOCKET_TIMEOUT_MS = int(os.getenv('MONGO_SOCKET_TIMEOUT_MS', 20000))
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv('MONGO_WAIT_QUEUE_TIMEOUT_MS', 10000))
+MONGO_READ_PREFERENCE = os.getenv('MONGO_READ_PREFERENCE', 'primary')
+
+# Number of threads allowed to run blocking pymongo calls at the same time
+DB_MAX_WORKERS = int(os.getenv('DB_MAX_WORKERS', 32))
+
+_client = None
+_executor = None
+_lock = threading.Lock()
+
+
+# Creating the shared Mongo client on first use
+def get_client():
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                _client = MongoClient(
+                    MONGO_URL,
+                    maxPoolSize=MONGO_MAX_POOL_SIZE,
+                    minPoolSize=MONGO_MIN_POOL_SIZE,
+                    maxIdleTimeMS=MONGO_MAX_IDLE_TIME_MS,
+                    connectTimeoutMS=MONGO_CONNECT_TIMEOUT_MS,
+                    serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+                    socketTimeoutMS=MONGO_SOCKET_TIMEOUT_MS,
+                    waitQueueTimeoutMS=MONGO_WAIT_QUEUE_TIMEOUT_MS,
+                    readPreference=MONGO_READ_PREFERENCE,
+                )
+    return _client
+
+
+def get_db():
+    return get_client()[MONGO_DB_NAME]
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        with _lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=DB_MAX_WORKERS, thread_name_prefix="mongo")
+    return _executor
+
+
+# Closing the shared client and waiting for in-flight database calls on shutdown
+def close_client():
+    global _client, _executor
+    with _lock:
+        if _executor is not None:
+            _executor.shutdown(wait=True)
+            _executor = None
+        if _client is not None:
+            _client.close()
+            _client = None
+
+
+# Running a blocking database call on the db thread pool
+async def run_db(func, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_executor(), partial(func, *args, **kwargs))
+
+
+class AsyncCollection:
+    """Awaitable wrapper around a pymongo collection.
+
+    Every call is pushed onto the bounded db thread pool, so a slow query only
+    holds one pool thread instead of the event loop. Cursors are drained inside
+    the pool and returned as lists. The underlying collection is looked up on
+    the shared client lazily, so importing a module never opens a connection.
+    """
+
+    def __init__(self, name):
+        self.name = name
+
+    @property
+    def collection(self):
+        return get_db()[self.name]
+
+    async def find_one(self, *args, **kwargs):
+        return await run_db(self.collection.find_one, *args, **kwargs)
+
+    async def find(self, *args, **kwargs):
+        return await run_db(lambda: list(self.collection.find(*args, **kwargs)))
+
+    async def aggregate(self, pipeline, **kwargs):
+        return await run_db(lambda: list(self.collection.aggregate(pipeline, **kwargs)))
+
+    async def distinct(self, key, *args, **kwargs):
+        return await run_db(self.collection.distinct, key, *args, **kwargs)
+
+    async def count_documents(self, *args, **kwargs):
+        return await run_db(self.collection.count_documents, *args, **kwargs)
+
+    async def insert_one(self, *args, **kwargs):
+        return await run_db(self.collection.insert_one, *args, **kwargs)
+
+    async def insert_many(self, *args, **kwargs):
+        return await run_db(self.collection.insert_many, *args, **kwargs)
+
+    async def update_one(self, *args, **kwargs):
+        return await run_db(self.collection.update_one, *args, **kwargs)
+
+    async def update_many(self, *args, **kwargs):
+        return await run_db(self.collection.update_many, *args, **kwargs)
+
+    async def find_one_and_update(self, *args, **kwargs):
+        return await run_db(self.collection.find_one_and_update, *args, **kwargs)
+
+    async def delete_many(self, *args, **kwargs):
+        return await run_db(self.collection.delete_many, *args, **kwargs)
+
+    async def bulk_write(self, *args, **kwargs):
+        return await run_db(self.collection.bulk_write, *args, **kwargs)
+
+    async def create_index(self, *args, **kwargs):
+        return await run_db(self.collection.create_index, *args, **kwargs)
@@ -0,0 +1,359 @@
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+import asyncio
+import random
+import threading
+import time
+import weakref
+import os
+from dotenv import load_dotenv
+load_dotenv()
+
+# LLM gateway settings
+LLM_BACKEND = os.getenv('LLM_BACKEND', 'gemini')
+LLM_MODEL = os.getenv('LLM_MODEL', 'gemini-1.5-flash')
+LLM_MAX_CONCURRENCY = int(os.getenv('LLM_MAX_CONCURRENCY', 16))
+LLM_MAX_CONCURRENCY_PER_USER = int(os.getenv('LLM_MAX_CONCURRENCY_PER_USER', 2))
+LLM_ATTEMPT_TIMEOUT = float(os.getenv('LLM_ATTEMPT_TIMEOUT', 20))
+LLM_DEADLINE = float(os.getenv('LLM_DEADLINE', 45))
+# Longest wait for a free slot before a call is turned away as busy; queueing
+# here is our own load, so it never counts against the provider
+LLM_QUEUE_TIMEOUT = float(os.getenv('LLM_QUEUE_TIMEOUT', 10))
+LLM_MAX_RETRIES = int(os.getenv('LLM_MAX_RETRIES', 2))
+LLM_RETRY_BASE_DELAY = float(os.getenv('LLM_RETRY_BASE_DELAY', 0.5))
+LLM_BREAKER_FAILURES = int(os.getenv('LLM_BREAKER_FAILURES', 5))
+LLM_BREAKER_COOLDOWN = float(os.getenv('LLM_BREAKER_COOLDOWN', 30))
+
+
+class LLMUnavailable(RuntimeError):
+    """The LLM call failed, timed out or was refused by the open circuit breaker."""
+
+
+class GeminiBackend:
+    """Blocking calls to Google Gemini, run on the gateway's thread pool."""
+
+    def __init__(self, model_name=LLM_MODEL):
+        import google.generativeai as genai
+        api_key = os.getenv("LLM")
+        if not api_key:
+            raise EnvironmentError("LLM API key not found. Please check your .env file.")
+        genai.configure(api_key=api_key)
+        self.genai = genai
+        self.model_name = model_name
+        self.models = {}
+
+    def _model(self, system=None):
+        if system not in self.models:
+            self.models[system] = self.genai.GenerativeModel(self.model_name, system_instruction=system)
+        return self.models[system]
+
+    def generate(self, prompt, system=None):
+        return self._model(system).generate_content(prompt).text
+
+    def stream(self, prompt, system=None):
+        for chunk in self._model(system).generate_content(prompt, stream=True):
+            if chunk.text:
+                yield chunk.text
+
+
+class FakeBackend:
+    """Local stand-in for Gemini used in tests and offline development.
+
+    responder(prompt, system) returns the reply text; by default every
+    prompt gets "neutral".
+    """
+
+    def __init__(self, responder=None, delay=0.0):
+        self.responder = responder or (lambda prompt, system=None: "neutral")
+        self.delay = delay
+        self.calls = 0
+
+    def generate(self, prompt, system=None):
+        self.calls += 1
+        if self.delay:
+            time.sleep(self.delay)
+        return self.responder(prompt, system)
+
+    def stream(self, prompt, system=None):
+        words = self.generate(prompt, system).split(" ")
+        for i, word in enumerate(words):
+            yield word if i == len(words) - 1 else word + " "
+
+
+def make_backend(name=LLM_BACKEND):
+    if name == "fake":
+        return FakeBackend()
+    if name == "gemini":
+        return GeminiBackend()
+    raise ValueError(f"Unknown LLM backend: {name}")
+
+
+class CircuitBreaker:
+    """Opens after a run of consecutive failures and fails fast until the
+    cooldown has passed; then lets one trial call through (half open)."""
+
+    def __init__(self, failures=LLM_BREAKER_FAILURES, cooldown=LLM_BREAKER_COOLDOWN):
+        self.max_failures = failures
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+        self.trials = 0
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.cooldown:
+            return "half_open"
+        return "open"
+
+    def allow(self):
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self.trial_running:
+            self.trial_running = True
+            self.trials += 1
+            return True
+        return False
+
+    # The running trial, taken right after allow(): None unless that call is it
+    def current_trial(self):
+        return self.trials if self.trial_running else None
+
+    # A trial that ended without an outcome, cancelled or a stream its reader
+    # dropped, lets the next call through instead of keeping the breaker shut
+    def abandon(self, trial):
+        if trial is not None and self.trial_running and self.trials == trial:
+            self.trial_running = False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+
+    def record_failure(self):
+        self.failures += 1
+        self.trial_running = False
+        if self.opened_at is not None or self.failures >= self.max_failures:
+            self.opened_at = time.monotonic()
+
+
+class LLMGateway:
+    """Single entry point for every LLM call in the backend.
+
+    Calls run on a dedicated thread pool so they never block the event loop.
+    A global and a per-user semaphore bound concurrency; a call that can't
+    get a slot within LLM_QUEUE_TIMEOUT is turned away as busy. Every attempt
+    has a timeout and the call an overall deadline, both counted from when a
+    thread starts on it, failures are retried with jittered exponential
+    backoff, and the circuit breaker refuses calls while the provider keeps
+    failing. Only the provider's own failures and timeouts count toward it.
+    """
+
+    def __init__(self, backend=None):
+        self._backend = backend
+        self.executor = ThreadPoolExecutor(max_workers=LLM_MAX_CONCURRENCY, thread_name_prefix="llm")
+        self.semaphore = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+        self.user_semaphores = weakref.WeakValueDictionary()
+        self.breaker = CircuitBreaker()
+        self.calls = 0
+        self.failures = 0
+        self.timeouts = 0
+        self.rejected = 0
+        self.busy = 0
+        self.running = 0
+
+    @property
+    def backend(self):
+        if self._backend is None:
+            self._backend = make_backend()
+        return self._backend
+
+    @backend.setter
+    def backend(self, backend):
+        self._backend = backend
+
+    def _user_semaphore(self, user):
+        semaphore = self.user_semaphores.get(user)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(LLM_MAX_CONCURRENCY_PER_USER)
+            self.user_semaphores[user] = semaphore
+        return semaphore
+
+    async def generate(self, prompt, user=None, system=None, deadline=LLM_DEADLINE):
+        if not self.breaker.allow():
+            self.rejected += 1
+            raise LLMUnavailable("The assistant is temporarily unavailable, please try again later.")
+        trial = self.breaker.current_trial()
+        try:
+            async with self._slot(user):
+                return await self._attempts(prompt, system, trial, deadline)
+        except BaseException:
+            self.breaker.abandon(trial)
+            raise
+
+    # Holding a per-user and a global slot for the call, waiting at most LLM_QUEUE_TIMEOUT
+    @asynccontextmanager
+    async def _slot(self, user):
+        loop = asyncio.get_running_loop()
+        end = loop.time() + LLM_QUEUE_TIMEOUT
+        user_semaphore = self._user_semaphore(user) if user is not None else None
+        if user_semaphore is not None:
+            await self._acquire(user_semaphore, end - loop.time())
+        try:
+            await self._acquire(self.semaphore, end - loop.time())
+            try:
+                yield
+            finally:
+                self.semaphore.release()
+        finally:
+            if user_semaphore is not None:
+                user_semaphore.release()
+
+    async def _acquire(self, semaphore, timeout):
+        try:
+            await asyncio.wait_for(semaphore.acquire(), max(0, timeout))
+        except asyncio.TimeoutError:
+            self.busy += 1
+            raise LLMUnavailable("The assistant is busy, please try again shortly.")
+
+    # Running func on the LLM threads. started resolves once a thread picks it
+    # up: threads still stuck in attempts that already timed out hold up new
+    # ones, and that wait is not the provider's
+    def _submit(self, loop, func, *args):
+        started = loop.create_future()
+
+        def run():
+            loop.call_soon_threadsafe(self._thread_started, started)
+            try:
+                return func(*args)
+            finally:
+                loop.call_soon_threadsafe(self._thread_finished)
+
+        return started, loop.run_in_executor(self.executor, run)
+
+    def _thread_started(self, started):
+        self.running += 1
+        if not started.done():
+            started.set_result(None)
+
+    def _thread_finished(self):
+        self.running -= 1
+
+    async def _wait_started(self, started, job, timeout):
+        try:
+            await asyncio.wait_for(started, max(0, timeout))
+        except asyncio.TimeoutError:
+            job.cancel()
+            self.busy += 1
+            raise LLMUnavailable("The assistant is busy, please try again shortly.")
+
+    async def _attempts(self, prompt, system, trial, deadline):
+        loop = asyncio.get_running_loop()
+        # the deadline runs from when the call got its slot, not from when it queued
+        end = loop.time() + deadline
+        error = None
+        for attempt in range(LLM_MAX_RETRIES + 1):
+            if attempt:
+                delay = LLM_RETRY_BASE_DELAY * 2 ** (attempt - 1) * random.uniform(0.5, 1.5)
+                if loop.time() + delay >= end:
+                    break
+                await asyncio.sleep(delay)
+                if not self.breaker.allow():
+                    break
+                trial = self.breaker.current_trial()
+            started, reply = self._submit(loop, self.backend.generate, prompt, system)
+            try:
+                await self._wait_started(started, reply, end - loop.time())
+                self.calls += 1
+                text = await asyncio.wait_for(reply, max(0, min(LLM_ATTEMPT_TIMEOUT, end - loop.time())))
+            except LLMUnavailable:
+                self.breaker.abandon(trial)
+                raise
+            except Exception as e:
+                self.failures += 1
+                if isinstance(e, asyncio.TimeoutError):
+                    self.timeouts += 1
+                self.breaker.record_failure()
+                error = e
+                continue
+            except BaseException:
+                self.breaker.abandon(trial)
+                raise
+            self.breaker.record_success()
+            return text
+        if error is None or isinstance(error, asyncio.TimeoutError):
+            raise LLMUnavailable("The assistant took too long to respond.") from error
+        raise LLMUnavailable("LLM call failed: " + str(error)) from error
+
+    # Yields the reply chunk by chunk as the backend produces it. Streams are
+    # not retried since part of the reply may already have been sent.
+    async def stream(self, prompt, user=None, system=None, deadline=LLM_DEADLINE):
+        if not self.breaker.allow():
+            self.rejected += 1
+            raise LLMUnavailable("The assistant is temporarily unavailable, please try again later.")
+        trial = self.breaker.current_trial()
+        try:
+            async with self._slot(user):
+                async for chunk in self._stream(prompt, system, deadline):
+                    yield chunk
+        finally:
+            # also reached on GeneratorExit when the reader stops early
+            self.breaker.abandon(trial)
+
+    async def _stream(self, prompt, system, deadline):
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        finished = object()
+        cancelled = threading.Event()
+
+        def produce():
+            try:
+                for chunk in self.backend.stream(prompt, system):
+                    if cancelled.is_set():
+                        return
+                    loop.call_soon_threadsafe(queue.put_nowait, chunk)
+                loop.call_soon_threadsafe(queue.put_nowait, finished)
+            except Exception as e:
+                loop.call_soon_threadsafe(queue.put_nowait, e)
+
+        end = loop.time() + deadline
+        started, job = self._submit(loop, produce)
+        try:
+            await self._wait_started(started, job, end - loop.time())
+            self.calls += 1
+            while True:
+                # every chunk must arrive within the attempt timeout and before the deadline
+                try:
+                    item = await asyncio.wait_for(queue.get(), max(0, min(LLM_ATTEMPT_TIMEOUT, end - loop.time())))
+                except asyncio.TimeoutError:
+                    self.timeouts += 1
+                    self.breaker.record_failure()
+                    raise LLMUnavailable("The assistant took too long to respond.")
+                if item is finished:
+                    break
+                if isinstance(item, Exception):
+                    self.failures += 1
+                    self.breaker.record_failure()
+                    raise LLMUnavailable("LLM call failed: " + str(item)) from item
+                yield item
+            self.breaker.record_success()
+        finally:
+            cancelled.set()
+
+    def stats(self):
+        return {
+            "breaker": self.breaker.state,
+            "calls": self.calls,
+            "failures": self.failures,
+            "timeouts": self.timeouts,
+            "rejected": self.rejected,
+            "busy": self.busy,
+            # threads still working, including attempts that already timed out
+            "running": self.running,
+        }
+
+
+llm_gateway = LLMGateway()
@@ -2,10 +2,50 @@ from fastapi import FastAPI
 from api.routes import router as auth_router
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import FileResponse
+from contextlib import asynccontextmanager
+from database.db import get_client, close_client
+from auth.user_auth import ensure_indexes, collection as users_collection
+from auth.hashing import hash_pool, require_contact_hash_key
+from search.geo_index import geo_index, GEO_INDEX_ENABLED
+from search.professions import profession_index
+from Community.moderation_queue import moderation_queue
+from Community.community import ensure_indexes as ensure_community_indexes
+from Community.feed import community_feed
+from realtime.connections import connection_manager
+from search.locations import location_buffer
+from Chatbot.Chatbot_logic import ensure_indexes as ensure_chatbot_indexes
+from chat.messages import ensure_indexes as ensure_chat_indexes
+from chat.summaries import ensure_indexes as ensure_chat_summary_indexes
 import os
 from fastapi.staticfiles import StaticFiles
 
-app = FastAPI()
+
+# Opening the shared Mongo client on startup and closing it on shutdown
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    require_contact_hash_key()
+    get_client()
+    await ensure_indexes()
+    await ensure_chatbot_indexes()
+    await ensure_chat_indexes()
+    await ensure_chat_summary_indexes()
+    await ensure_community_indexes()
+    await community_feed.load()
+    await profession_index.load(users_collection)
+    if GEO_INDEX_ENABLED:
+        await geo_index.load(users_collection)
+    await connection_manager.start()
+    await location_buffer.start()
+    await moderation_queue.start()
+    yield
+    await moderation_queue.stop()
+    await location_buffer.stop()
+    await connection_manager.stop()
+    hash_pool.shutdown()
+    close_client()
+
+
+app = FastAPI(lifespan=lifespan)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],  # You can restrict this to specific origins
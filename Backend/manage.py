@@ -0,0 +1,149 @@
+"""Maintenance commands for the backend. Run from the Backend directory:
+
+    python manage.py migrate-chatbot-history
+    python manage.py migrate-chat-buckets
+    python manage.py backfill-chat-summaries
+    python manage.py bulk-import professionals.ndjson [--format csv]
+
+bulk-import tells the running servers about the new users over the realtime
+bus, so it needs REALTIME_BUS=redis; with the in-process memory bus use
+POST /register/bulk instead.
+"""
+import argparse
+import asyncio
+import json
+from database.db import close_client
+
+
+# Moving conversation logs written before the bucketed history into buckets
+async def migrate_chatbot_history(args):
+    from Chatbot.Chatbot_logic import convo, ensure_indexes, migrate_legacy
+    await ensure_indexes()
+    migrated = 0
+    for user_data in await convo.find({'turn_count': {'$exists': False}}, {'username': 1, 'conversation_log': 1}):
+        # users who chatted since the deploy were already moved on their turn
+        if await migrate_legacy(user_data):
+            migrated += 1
+    print(f"Migrated {migrated} chatbot conversations")
+
+
+# Moving the messages arrays of the old Chat documents, and buckets keyed by
+# their ids, into buckets keyed by the pair of usernames
+async def migrate_chat_buckets(args):
+    from chat.messages import Chat, buckets, ensure_indexes, bucket_of, chat_key
+    await ensure_indexes()
+
+    # merged with anything already sent to the bucket since the deploy, in time order
+    async def merge(key, participants, bucket, messages):
+        await buckets.update_one(
+            {'chat_id': key, 'bucket': bucket},
+            {'$push': {'messages': {'$each': messages, '$sort': {'timestamp': 1}}},
+             '$inc': {'count': len(messages)},
+             '$max': {'last_updated': messages[-1]['timestamp']},
+             '$setOnInsert': {'participants': participants}},
+            upsert=True,
+        )
+
+    migrated = 0
+    for chat in await Chat.find({}):
+        key = chat_key(chat['user 1'], chat['user 2'])
+        participants = sorted([chat['user 1'], chat['user 2']])
+        grouped = {}
+        for message in chat.get('messages', []):
+            grouped.setdefault(bucket_of(message['timestamp']), []).append(message)
+        for bucket, messages in grouped.items():
+            await merge(key, participants, bucket, messages)
+        for document in await buckets.find({'chat_id': chat['_id']}):
+            await merge(key, participants, document['bucket'], document['messages'])
+            await buckets.delete_many({'_id': document['_id']})
+        await Chat.delete_many({'_id': chat['_id']})
+        migrated += 1
+    print(f"Migrated {migrated} chats")
+
+
+# Building the chat summaries from the messages already in the buckets
+async def backfill_chat_summaries(args):
+    from pymongo import UpdateOne
+    from chat.messages import buckets
+    from chat.summaries import summaries, ensure_indexes
+    await ensure_indexes()
+    latest = await buckets.aggregate([
+        {'$unwind': '$messages'},
+        {'$sort': {'messages.timestamp': 1}},
+        {'$group': {
+            '_id': {'chat_id': '$chat_id', 'sender': '$messages.sender'},
+            'text': {'$last': '$messages.text'},
+            'timestamp': {'$last': '$messages.timestamp'},
+        }},
+    ], allowDiskUse=True)
+    operations = []
+    for entry in latest:
+        sender = entry['_id']['sender']
+        for owner in json.loads(entry['_id']['chat_id']):
+            if owner == sender:
+                continue
+            key = {'owner': owner, 'counterpart': sender}
+            fields = {'message_text': entry['text'], 'timestamp': entry['timestamp']}
+            # a summary already written by a newer send is kept
+            operations.append(UpdateOne(key, {'$setOnInsert': dict(fields, unread=0)}, upsert=True))
+            operations.append(UpdateOne(dict(key, timestamp={'$lt': entry['timestamp']}), {'$set': fields}))
+    if operations:
+        await summaries.bulk_write(operations, ordered=True)
+    print(f"Backfilled {len(operations) // 2} chat summaries")
+
+
+# Registering the users of an NDJSON or CSV file. The servers' geo index,
+# profession index and search cache hear of them over the shared bus; a
+# memory bus only reaches this process, so the import is refused
+async def bulk_import(args):
+    from auth.user_auth import ensure_indexes
+    from auth.bulk_import import import_users, read_rows, read_lines
+    from auth.hashing import hash_pool
+    from realtime.connections import connection_manager, RedisBus
+    if not isinstance(connection_manager.bus, RedisBus):
+        raise SystemExit("bulk-import needs REALTIME_BUS=redis so the running servers see the new users; "
+                         "use POST /register/bulk with the memory bus")
+    await ensure_indexes()
+    fmt = args.format or ('csv' if args.path.lower().endswith('.csv') else 'ndjson')
+
+    async def chunks():
+        with open(args.path, 'rb') as file:
+            while chunk := file.read(1 << 16):
+                yield chunk
+
+    try:
+        report = await import_users(read_rows(read_lines(chunks()), fmt))
+    finally:
+        hash_pool.shutdown()
+        await connection_manager.bus.stop()
+    for error in report.errors:
+        print(f"row {error['row']}: {error['error']}")
+    print(f"Imported {report.inserted} of {report.rows} rows, {report.failed} failed")
+
+
+COMMANDS = {
+    "migrate-chatbot-history": migrate_chatbot_history,
+    "migrate-chat-buckets": migrate_chat_buckets,
+    "backfill-chat-summaries": backfill_chat_summaries,
+    "bulk-import": bulk_import,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("migrate-chatbot-history", help="move old chatbot logs into history buckets")
+    subparsers.add_parser("migrate-chat-buckets", help="move old 1-1 chat messages into buckets keyed by the pair of users")
+    subparsers.add_parser("backfill-chat-summaries", help="build the /chat_history summaries from existing chats")
+    bulk = subparsers.add_parser("bulk-import", help="register the users of an NDJSON or CSV file")
+    bulk.add_argument("path")
+    bulk.add_argument("--format", choices=["ndjson", "csv"], help="defaults to csv for .csv files, ndjson otherwise")
+    args = parser.parse_args()
+    try:
+        asyncio.run(COMMANDS[args.command](args))
+    finally:
+        close_client()
+
+
+if __name__ == "__main__":
+    main()
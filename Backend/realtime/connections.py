@@ -0,0 +1,263 @@
+from .presence import presence_index
+import asyncio
+import json
+import time
+import uuid
+import os
+from dotenv import load_dotenv
+load_dotenv()
+
+# Realtime settings
+REALTIME_BUS = os.getenv('REALTIME_BUS', 'memory')
+REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
+REALTIME_CHANNEL = os.getenv('REALTIME_CHANNEL', 'realtime')
+# Messages waiting for a socket before it is considered too slow and closed
+WS_SEND_QUEUE_SIZE = int(os.getenv('WS_SEND_QUEUE_SIZE', 64))
+# Every socket is sent a heartbeat this often; one whose send fails is closed
+WS_HEARTBEAT_INTERVAL = float(os.getenv('WS_HEARTBEAT_INTERVAL', 25))
+# Sockets that sent nothing for this long are closed, 0 turns this off. Only
+# for clients that answer the heartbeat: the app listens without writing
+WS_IDLE_TIMEOUT = float(os.getenv('WS_IDLE_TIMEOUT', 0))
+
+
+class MemoryBroker:
+    """Delivers every published message to all the buses attached to it.
+    One per process by default; sharing one between several managers stands
+    in for a real broker when testing several workers."""
+
+    def __init__(self):
+        self.handlers = set()
+
+    # A failing handler is logged like on the Redis bus, never raised to the publisher
+    async def publish(self, message):
+        for handler in list(self.handlers):
+            try:
+                await handler(message)
+            except Exception as e:
+                print("Realtime bus error:", e)
+
+
+class MemoryBus:
+    """Pub/sub bus inside the process, used with a single worker."""
+
+    def __init__(self, broker=None):
+        self.broker = broker or MemoryBroker()
+        self.handler = None
+
+    async def start(self, handler):
+        self.handler = handler
+        self.broker.handlers.add(handler)
+
+    async def stop(self):
+        self.broker.handlers.discard(self.handler)
+
+    async def publish(self, message):
+        await self.broker.publish(message)
+
+
+class RedisBus:
+    """Pub/sub bus over a Redis channel, so every uvicorn worker sees every
+    message and delivers it to the sockets it holds."""
+
+    def __init__(self, url=REDIS_URL, channel=REALTIME_CHANNEL):
+        import redis.asyncio as redis
+        self.redis = redis.from_url(url)
+        self.channel = channel
+        self.task = None
+
+    async def start(self, handler):
+        pubsub = self.redis.pubsub()
+        await pubsub.subscribe(self.channel)
+
+        async def listen():
+            async for item in pubsub.listen():
+                if item["type"] == "message":
+                    try:
+                        await handler(json.loads(item["data"]))
+                    except Exception as e:
+                        print("Realtime bus error:", e)
+
+        self.task = asyncio.ensure_future(listen())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+        await self.redis.aclose()
+
+    async def publish(self, message):
+        await self.redis.publish(self.channel, json.dumps(message))
+
+
+def make_bus(name=REALTIME_BUS):
+    if name == "memory":
+        return MemoryBus()
+    if name == "redis":
+        return RedisBus()
+    raise ValueError(f"Unknown realtime bus: {name}")
+
+
+class Connection:
+    """One open socket of a user with its own bounded send queue, drained by
+    a writer task so a slow client never holds up whoever sends to it."""
+
+    def __init__(self, websocket, username, queue_size=WS_SEND_QUEUE_SIZE):
+        self.websocket = websocket
+        self.username = username
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.last_seen = time.monotonic()
+        self.closed = False
+        self.writer = asyncio.ensure_future(self._write())
+
+    async def _write(self):
+        try:
+            while True:
+                text = await self.queue.get()
+                if text is None:
+                    break
+                await self.websocket.send_text(text)
+        except Exception:
+            pass
+        self.closed = True
+
+    # Queueing a message, False when the client has fallen too far behind
+    def send(self, text):
+        if self.closed:
+            return False
+        try:
+            self.queue.put_nowait(text)
+            return True
+        except asyncio.QueueFull:
+            return False
+
+    async def close(self, code=1000):
+        self.closed = True
+        self.writer.cancel()
+        try:
+            await self.websocket.close(code=code)
+        except Exception:
+            pass
+
+
+class ConnectionManager:
+    """Open sockets of every user connected to this worker.
+
+    A user may be connected from several devices at once. Messages for a user
+    go through the bus, so whichever worker holds their sockets delivers
+    them. Sockets that can't keep up with their queue, or that fail to take
+    the heartbeat, are closed; the client reconnects. Users coming online or
+    going offline here are announced on the bus to every worker's presence
+    index.
+    """
+
+    def __init__(self, bus=None, heartbeat=WS_HEARTBEAT_INTERVAL, idle_timeout=WS_IDLE_TIMEOUT, presence=presence_index):
+        self.bus = bus or make_bus()
+        self.presence = presence
+        self.worker = uuid.uuid4().hex
+        # handlers of the other kinds of bus messages, by type
+        self.handlers = {"presence": presence.apply}
+        self.heartbeat = heartbeat
+        self.idle_timeout = idle_timeout
+        self.connections = {}
+        self.task = None
+        self.delivered = 0
+        self.evicted = 0
+
+    async def start(self):
+        await self.bus.start(self._receive)
+        self.task = asyncio.ensure_future(self._heartbeat())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+        for username in list(self.connections):
+            await self._presence("offline", user=username)
+        await self.bus.stop()
+        for connection in [c for user in self.connections.values() for c in user]:
+            await connection.close(code=1001)
+        self.connections.clear()
+
+    # user: the user's document, its profession and location go to the presence index
+    async def connect(self, websocket, username, user=None):
+        await websocket.accept()
+        connection = Connection(websocket, username)
+        sockets = self.connections.setdefault(username, set())
+        sockets.add(connection)
+        if len(sockets) == 1:
+            user = user or {}
+            lon, lat = (user.get("location") or {}).get("coordinates", (None, None))
+            await self._presence("online", user=username, profession=user.get("profession"), lon=lon, lat=lat)
+        return connection
+
+    async def disconnect(self, connection, code=1000):
+        sockets = self.connections.get(connection.username)
+        if sockets is not None and connection in sockets:
+            sockets.discard(connection)
+            if not sockets:
+                del self.connections[connection.username]
+                await self._presence("offline", user=connection.username)
+        await connection.close(code)
+
+    async def _presence(self, event, **fields):
+        await self.publish("presence", event=event, **fields)
+
+    # Registering a handler called on every worker for bus messages of a type
+    def on(self, kind, handler):
+        self.handlers[kind] = handler
+
+    async def publish(self, kind, **fields):
+        await self.bus.publish({"type": kind, "worker": self.worker, **fields})
+
+    # Anything received from a socket shows it is alive
+    def touch(self, connection):
+        connection.last_seen = time.monotonic()
+
+    def is_connected(self, username):
+        return username in self.connections
+
+    # Sending a JSON payload to every socket of a user, on whichever worker they are
+    async def send_to_user(self, username, payload):
+        await self.bus.publish({"type": "deliver", "user": username, "text": json.dumps(payload, default=str)})
+        return True
+
+    async def _receive(self, message):
+        handler = self.handlers.get(message["type"])
+        if handler is not None:
+            handler(message)
+            return
+        for connection in list(self.connections.get(message["user"], ())):
+            if connection.send(message["text"]):
+                self.delivered += 1
+            else:
+                self.evicted += 1
+                await self.disconnect(connection, code=1013)
+
+    async def _heartbeat(self):
+        ping = json.dumps({"type": "ping"})
+        while True:
+            await asyncio.sleep(self.heartbeat)
+            now = time.monotonic()
+            for connection in [c for user in self.connections.values() for c in user]:
+                idle = self.idle_timeout and now - connection.last_seen > self.idle_timeout
+                # a heartbeat the writer failed to send leaves the connection closed
+                if connection.closed or idle or not connection.send(ping):
+                    self.evicted += 1
+                    await self.disconnect(connection, code=1001)
+            if self.connections:
+                await self._presence("refresh", users=list(self.connections))
+
+    def stats(self):
+        return {
+            "users": len(self.connections),
+            "sockets": sum(len(sockets) for sockets in self.connections.values()),
+            "delivered": self.delivered,
+            "evicted": self.evicted,
+            "online": len(self.presence),
+        }
+
+
+connection_manager = ConnectionManager()
+
+
+# Pushing a JSON payload to a user's connected devices
+async def send_to_user(username: str, payload: dict):
+    return await connection_manager.send_to_user(username, payload)
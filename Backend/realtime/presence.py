@@ -0,0 +1,97 @@
+from collections import Counter
+from search.geohash import encode
+import time
+import os
+from dotenv import load_dotenv
+load_dotenv()
+
+# A worker that stops refreshing its users for this long is taken as gone
+PRESENCE_TTL = float(os.getenv('PRESENCE_TTL', 90))
+PRESENCE_AREA_PRECISION = int(os.getenv('PRESENCE_AREA_PRECISION', 5))
+
+
+class PresenceIndex:
+    """Users with at least one open socket on any worker.
+
+    Every worker publishes online/offline events when a user's first socket
+    opens or last socket closes on it, and refreshes its users on each
+    heartbeat; the events reach every worker's index over the realtime bus.
+    A user is online while some worker has refreshed them within the TTL,
+    so a crashed worker's users drop off on their own.
+    """
+
+    def __init__(self, ttl=PRESENCE_TTL):
+        self.ttl = ttl
+        # username -> {"profession", "lon", "lat", "workers": {worker: last refresh}}
+        self.users = {}
+
+    def online(self, username, worker, profession=None, lon=None, lat=None):
+        entry = self.users.setdefault(username, {"workers": {}})
+        entry.update(profession=profession, lon=lon, lat=lat)
+        entry["workers"][worker] = time.monotonic()
+
+    def offline(self, username, worker):
+        entry = self.users.get(username)
+        if entry is not None:
+            entry["workers"].pop(worker, None)
+            if not entry["workers"]:
+                del self.users[username]
+
+    def refresh(self, usernames, worker):
+        now = time.monotonic()
+        for username in usernames:
+            entry = self.users.get(username)
+            if entry is not None:
+                entry["workers"][worker] = now
+
+    def move(self, username, lon, lat):
+        entry = self.users.get(username)
+        if entry is not None:
+            entry.update(lon=lon, lat=lat)
+
+    # Applying an event published on the realtime bus
+    def apply(self, event):
+        if event["event"] == "online":
+            self.online(event["user"], event["worker"], event.get("profession"), event.get("lon"), event.get("lat"))
+        elif event["event"] == "offline":
+            self.offline(event["user"], event["worker"])
+        elif event["event"] == "refresh":
+            self.refresh(event["users"], event["worker"])
+        elif event["event"] == "move":
+            self.move(event["user"], event["lon"], event["lat"])
+
+    def _alive(self, username, now):
+        entry = self.users.get(username)
+        if entry is None:
+            return False
+        for worker, seen in list(entry["workers"].items()):
+            if now - seen > self.ttl:
+                del entry["workers"][worker]
+        if not entry["workers"]:
+            del self.users[username]
+            return False
+        return True
+
+    def is_online(self, username):
+        return self._alive(username, time.monotonic())
+
+    # Online users per profession and per geohash area
+    def counts(self, precision=PRESENCE_AREA_PRECISION):
+        now = time.monotonic()
+        professions = Counter()
+        areas = Counter()
+        for username in list(self.users):
+            if not self._alive(username, now):
+                continue
+            entry = self.users[username]
+            if entry["profession"]:
+                professions[entry["profession"]] += 1
+            if entry["lat"] is not None:
+                areas[encode(entry["lat"], entry["lon"], precision)] += 1
+        return {"professions": dict(professions), "areas": dict(areas)}
+
+    def __len__(self):
+        return len(self.users)
+
+
+presence_index = PresenceIndex()
@@ -0,0 +1,228 @@
+from collections import defaultdict
+import math
+import os
+import numpy as np
+from dotenv import load_dotenv
+load_dotenv()
+
+# Turning the in-process index on and sizing its grid cells (degrees)
+GEO_INDEX_ENABLED = os.getenv('GEO_INDEX_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+GEO_INDEX_CELL_DEG = float(os.getenv('GEO_INDEX_CELL_DEG', 0.05))
+
+EARTH_RADIUS_M = 6371008.8
+METERS_PER_DEG_LAT = math.pi * EARTH_RADIUS_M / 180
+
+# Fields of a professional returned by the search; the contact number is
+# only stored as a digest, which is of no use to the client
+RESULT_FIELDS = ["username", "profession", "location", "address"]
+
+
+# Great-circle distance in meters from one point to arrays of points (degrees);
+# lat and lon may be column arrays too, giving every point against every other
+def haversine(lat, lon, lats, lons):
+    lat1 = np.radians(lat)
+    lat2 = np.radians(lats)
+    dlat = lat2 - lat1
+    dlon = np.radians(lons) - np.radians(lon)
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+class _Partition:
+    """All professionals of one profession.
+
+    Coordinates live in growable NumPy arrays so distances are computed for a
+    whole batch of candidates at once; a lat/lon grid maps each cell to the
+    array slots inside it so radius queries only look at nearby cells.
+    """
+
+    def __init__(self, cell_deg):
+        self.cell_deg = cell_deg
+        self.lon_cells = int(math.ceil(360 / cell_deg))
+        self.lats = np.zeros(64)
+        self.lons = np.zeros(64)
+        self.alive = np.zeros(64, dtype=bool)
+        self.records = []
+        self.slots = {}
+        self.slot_cells = []
+        self.cells = defaultdict(set)
+        self.free = []
+
+    def __len__(self):
+        return len(self.slots)
+
+    def _cell(self, lat, lon):
+        row = int(math.floor((lat + 90) / self.cell_deg))
+        col = int(math.floor((lon + 180) / self.cell_deg)) % self.lon_cells
+        return row, col
+
+    def _grow(self, size):
+        capacity = len(self.lats)
+        if size <= capacity:
+            return
+        while capacity < size:
+            capacity *= 2
+        for name in ("lats", "lons", "alive"):
+            old = getattr(self, name)
+            new = np.zeros(capacity, dtype=old.dtype)
+            new[:len(old)] = old
+            setattr(self, name, new)
+
+    def upsert(self, username, lon, lat, record):
+        slot = self.slots.get(username)
+        if slot is None:
+            if self.free:
+                slot = self.free.pop()
+            else:
+                slot = len(self.records)
+                self._grow(slot + 1)
+                self.records.append(None)
+                self.slot_cells.append(None)
+            self.slots[username] = slot
+        else:
+            old_cell = self.slot_cells[slot]
+            self.cells[old_cell].discard(slot)
+            if not self.cells[old_cell]:
+                del self.cells[old_cell]
+        cell = self._cell(lat, lon)
+        self.lats[slot] = lat
+        self.lons[slot] = lon
+        self.alive[slot] = True
+        self.records[slot] = record
+        self.slot_cells[slot] = cell
+        self.cells[cell].add(slot)
+
+    def remove(self, username):
+        slot = self.slots.pop(username, None)
+        if slot is None:
+            return
+        cell = self.slot_cells[slot]
+        self.cells[cell].discard(slot)
+        if not self.cells[cell]:
+            del self.cells[cell]
+        self.alive[slot] = False
+        self.records[slot] = None
+        self.slot_cells[slot] = None
+        self.free.append(slot)
+
+    def _candidates(self, lat, lon, radius_m):
+        dlat = radius_m / METERS_PER_DEG_LAT
+        cos_lat = math.cos(math.radians(min(abs(lat) + dlat, 90.0)))
+        dlon = 180.0 if cos_lat < 1e-6 else min(dlat / cos_lat, 180.0)
+        min_row, min_col = self._cell(max(lat - dlat, -90.0), lon - dlon)
+        max_row, _ = self._cell(min(lat + dlat, 90.0), lon + dlon)
+        col_span = min(int(math.ceil(2 * dlon / self.cell_deg)) + 1, self.lon_cells)
+        # scanning the whole partition is cheaper than walking a huge block of cells
+        if (max_row - min_row + 1) * col_span >= len(self.cells):
+            return np.flatnonzero(self.alive[:len(self.records)])
+        slots = []
+        for row in range(min_row, max_row + 1):
+            for step in range(col_span):
+                cell = self.cells.get((row, (min_col + step) % self.lon_cells))
+                if cell:
+                    slots.extend(cell)
+        return np.fromiter(slots, dtype=np.int64, count=len(slots))
+
+    def radius(self, lat, lon, radius_m):
+        slots = self._candidates(lat, lon, radius_m)
+        if len(slots) == 0:
+            return []
+        distances = haversine(lat, lon, self.lats[slots], self.lons[slots])
+        inside = distances <= radius_m
+        slots, distances = slots[inside], distances[inside]
+        order = np.argsort(distances, kind="stable")
+        return [(self.records[slots[i]], float(distances[i])) for i in order]
+
+
+class GeoIndex:
+    """In-process spatial index of professionals, partitioned by profession.
+
+    Answers radius and k-nearest queries without touching Mongo. It is filled
+    once from User_Auth with load() and then kept in sync through upsert() as
+    professionals register.
+    """
+
+    def __init__(self, cell_deg=GEO_INDEX_CELL_DEG):
+        self.cell_deg = cell_deg
+        self.partitions = {}
+        self.professions = {}
+        self.ready = False
+
+    def __len__(self):
+        return len(self.professions)
+
+    # Adding or replacing a professional from a User_Auth document
+    def upsert(self, user):
+        location = user.get("location")
+        if not location or not user.get("profession"):
+            return
+        lon, lat = location["coordinates"][0], location["coordinates"][1]
+        username = user["username"]
+        profession = user["profession"]
+        old_profession = self.professions.get(username)
+        if old_profession is not None and old_profession != profession:
+            self.partitions[old_profession].remove(username)
+        record = {field: user.get(field) for field in RESULT_FIELDS}
+        if profession not in self.partitions:
+            self.partitions[profession] = _Partition(self.cell_deg)
+        self.partitions[profession].upsert(username, lon, lat, record)
+        self.professions[username] = profession
+
+    def remove(self, username):
+        profession = self.professions.pop(username, None)
+        if profession is not None:
+            self.partitions[profession].remove(username)
+
+    # Moving an indexed professional, returns the updated record or None
+    def update_location(self, username, lon, lat):
+        profession = self.professions.get(username)
+        if profession is None:
+            return None
+        partition = self.partitions[profession]
+        record = dict(partition.records[partition.slots[username]])
+        record["location"] = {"type": "Point", "coordinates": [lon, lat]}
+        partition.upsert(username, lon, lat, record)
+        return record
+
+    # Professionals within radius_m meters, nearest first, as (record, distance) pairs
+    def radius(self, profession, lon, lat, radius_m, limit=None):
+        partition = self.partitions.get(profession)
+        if partition is None:
+            return []
+        hits = partition.radius(lat, lon, radius_m)
+        return hits if limit is None else hits[:limit]
+
+    # The k nearest professionals, found by widening the radius until k are inside it
+    def nearest(self, profession, lon, lat, k, max_distance=None):
+        partition = self.partitions.get(profession)
+        if partition is None or k <= 0:
+            return []
+        max_distance = math.pi * EARTH_RADIUS_M if max_distance is None else max_distance
+        radius_m = min(self.cell_deg * METERS_PER_DEG_LAT, max_distance)
+        while True:
+            hits = partition.radius(lat, lon, radius_m)
+            if len(hits) >= k or radius_m >= max_distance:
+                return hits[:k]
+            radius_m = min(radius_m * 2, max_distance)
+
+    # Building the index from every professional stored in Mongo
+    async def load(self, collection):
+        users = await collection.find(
+            {"profession": {"$exists": True}, "location": {"$exists": True}},
+            {"_id": 0, **{field: 1 for field in RESULT_FIELDS}},
+        )
+        self.partitions = {}
+        self.professions = {}
+        for user in users:
+            self.upsert(user)
+        self.ready = True
+
+    def stats(self):
+        return {
+            "ready": self.ready,
+            "professionals": len(self.professions),
+            "professions": {name: len(partition) for name, partition in self.partitions.items()},
+        }
+
+
+geo_index = GeoIndex()
@@ -0,0 +1,53 @@
+# Minimal geohash encoder/decoder used to quantize user locations into cells
+
+BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+DECODE_MAP = {char: index for index, char in enumerate(BASE32)}
+
+
+def encode(lat: float, lon: float, precision: int = 6):
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    bit_count = 0
+    even = True
+    while len(chars) < precision:
+        rng, value = (lon_range, lon) if even else (lat_range, lat)
+        mid = (rng[0] + rng[1]) / 2
+        if value >= mid:
+            bits = (bits << 1) | 1
+            rng[0] = mid
+        else:
+            bits = bits << 1
+            rng[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(BASE32[bits])
+            bits = 0
+            bit_count = 0
+    return "".join(chars)
+
+
+# Returns the cell's (lat, lon) bounds as ((min_lat, max_lat), (min_lon, max_lon))
+def bounds(geohash: str):
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    even = True
+    for char in geohash:
+        value = DECODE_MAP[char]
+        for shift in range(4, -1, -1):
+            rng = lon_range if even else lat_range
+            mid = (rng[0] + rng[1]) / 2
+            if (value >> shift) & 1:
+                rng[0] = mid
+            else:
+                rng[1] = mid
+            even = not even
+    return tuple(lat_range), tuple(lon_range)
+
+
+# Returns the centre (lat, lon) of a cell
+def decode(geohash: str):
+    (min_lat, max_lat), (min_lon, max_lon) = bounds(geohash)
+    return (min_lat + max_lat) / 2, (min_lon + max_lon) / 2
@@ -0,0 +1,134 @@
+from collections import defaultdict
+from datetime import datetime
+from pymongo import UpdateOne
+from auth.user_auth import collection
+from auth.auth_cache import user_cache
+from realtime.connections import connection_manager
+from realtime.presence import presence_index
+from .geo_index import geo_index
+from .search_cache import search_cache
+import asyncio
+import os
+from dotenv import load_dotenv
+load_dotenv()
+
+# Location pings are written to Mongo in batches every LOCATION_FLUSH_INTERVAL seconds
+LOCATION_FLUSH_INTERVAL = float(os.getenv('LOCATION_FLUSH_INTERVAL', 2))
+LOCATION_MAX_BATCH = int(os.getenv('LOCATION_MAX_BATCH', 1000))
+
+
+class LocationBuffer:
+    """Write-behind buffer for the location pings of moving professionals.
+
+    A ping only replaces the user's pending position, so a professional
+    pinging every second costs one write per flush rather than one per
+    ping. Each flush writes the batch with one unordered bulk_write and
+    publishes it on the realtime bus, so every worker moves the users in its
+    geo index, drops the cached searches around the old and new positions
+    and updates presence.
+    """
+
+    def __init__(self, interval=LOCATION_FLUSH_INTERVAL, max_batch=LOCATION_MAX_BATCH):
+        self.interval = interval
+        self.max_batch = max_batch
+        # username -> {"profession", "lon", "lat", "old", "at"}
+        self.pending = {}
+        # last flushed position of every moved user, the old position of their next move
+        self.positions = {}
+        self.task = None
+        self.pings = 0
+        self.written = 0
+        self.flushes = 0
+
+    async def start(self):
+        connection_manager.on("locations", self.apply)
+        self.task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            self.task = None
+        try:
+            while self.pending:
+                await self.flush()
+        except Exception as e:
+            print("Location flush error:", e)
+
+    # Recording a ping, user is the pinging user's document
+    def ping(self, user, lon: float, lat: float):
+        username = user["username"]
+        entry = self.pending.get(username)
+        if entry is None:
+            old = self.positions.get(username) or (user.get("location") or {}).get("coordinates")
+            entry = self.pending[username] = {"profession": user.get("profession"), "old": old}
+        entry.update(lon=lon, lat=lat, at=datetime.utcnow())
+        self.pings += 1
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                while self.pending:
+                    await self.flush()
+            except Exception as e:
+                print("Location flush error:", e)
+
+    async def flush(self):
+        usernames = list(self.pending)[:self.max_batch]
+        batch = {username: self.pending.pop(username) for username in usernames}
+        if not batch:
+            return
+        try:
+            await collection.bulk_write([
+                UpdateOne(
+                    {"username": username},
+                    {"$set": {
+                        "location": {"type": "Point", "coordinates": [entry["lon"], entry["lat"]]},
+                        "location_updated": entry["at"],
+                    }},
+                )
+                for username, entry in batch.items()
+            ], ordered=False)
+        except Exception:
+            # put back the pings not superseded by newer ones, retried on the next flush
+            for username, entry in batch.items():
+                self.pending.setdefault(username, entry)
+            raise
+        self.written += len(batch)
+        self.flushes += 1
+        moves = [
+            {"user": username, "profession": entry["profession"], "lon": entry["lon"], "lat": entry["lat"], "old": entry["old"]}
+            for username, entry in batch.items()
+        ]
+        await connection_manager.publish("locations", moves=moves)
+
+    # Moving flushed users in this worker's in-memory indexes
+    def apply(self, message):
+        # old and new positions by profession, checked against the cache once per profession
+        points = defaultdict(list)
+        for move in message["moves"]:
+            username, lon, lat = move["user"], move["lon"], move["lat"]
+            self.positions[username] = [lon, lat]
+            if geo_index.ready:
+                geo_index.update_location(username, lon, lat)
+            if move["profession"]:
+                if move["old"]:
+                    points[move["profession"]].append(tuple(move["old"]))
+                points[move["profession"]].append((lon, lat))
+            presence_index.move(username, lon, lat)
+            cached = user_cache.peek(username)
+            if cached is not None:
+                user_cache.set(username, dict(cached, location={"type": "Point", "coordinates": [lon, lat]}))
+        for profession, locations in points.items():
+            search_cache.invalidate_many(profession, locations)
+
+    def stats(self):
+        return {
+            "pending": len(self.pending),
+            "pings": self.pings,
+            "written": self.written,
+            "flushes": self.flushes,
+        }
+
+
+location_buffer = LocationBuffer()
@@ -0,0 +1,109 @@
+from auth.user_auth import collection
+from .geo_index import geo_index, RESULT_FIELDS
+from .search_cache import search_cache, SEARCH_CACHE_ENABLED
+from .professions import clean
+import base64
+import json
+import os
+from dotenv import load_dotenv
+load_dotenv()
+
+# Search radius in meters around the user
+SEARCH_RADIUS_M = int(os.getenv('SEARCH_RADIUS_M', 5000))
+SEARCH_MAX_RADIUS_M = int(os.getenv('SEARCH_MAX_RADIUS_M', 50000))
+SEARCH_PAGE_SIZE = int(os.getenv('SEARCH_PAGE_SIZE', 20))
+SEARCH_MAX_PAGE_SIZE = int(os.getenv('SEARCH_MAX_PAGE_SIZE', 100))
+SEARCH_MAX_BATCH = int(os.getenv('SEARCH_MAX_BATCH', 20))
+
+
+# Professionals of the given profession near a point, nearest first
+async def find_nearby(profession: str, lon: float, lat: float, radius_m: int = SEARCH_RADIUS_M):
+    # only case and spacing are evened out, typos are for the suggestions to correct
+    profession = clean(profession)
+    if geo_index.ready:
+        return [record for record, distance in geo_index.radius(profession, lon, lat, radius_m)]
+    if SEARCH_CACHE_ENABLED:
+        return await search_cache.search(profession, lon, lat, radius_m, query_nearby)
+    return await query_nearby(profession, lon, lat, radius_m)
+
+
+# Running the $nearSphere search against Mongo
+async def query_nearby(profession: str, lon: float, lat: float, radius_m: int):
+    # MongoDB query to search for professionals of the given profession near the current user
+    search_results = await collection.find(
+        {
+            "profession": profession,
+            "location": {
+                "$nearSphere": {
+                    "$geometry": {
+                        "type": "Point",
+                        "coordinates": [lon, lat]
+                    },
+                    "$maxDistance": radius_m
+                }
+            }
+        }
+    )
+    return [{field: result[field] for field in RESULT_FIELDS} for result in search_results]
+
+
+# The continuation cursor is the distance of the last result plus the usernames
+# already returned at exactly that distance
+def encode_cursor(distance: float, usernames):
+    raw = json.dumps({"d": distance, "u": sorted(usernames)}).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        data = json.loads(raw)
+        return float(data["d"]), list(data["u"])
+    except (ValueError, KeyError, TypeError):
+        raise ValueError("Invalid cursor")
+
+
+# One page of professionals near a point, each with its distance in meters
+async def find_nearby_page(profession: str, lon: float, lat: float, radius_m: int, page_size: int, cursor: str = None):
+    min_distance, seen = decode_cursor(cursor) if cursor else (0.0, [])
+    profession = clean(profession)
+
+    if geo_index.ready:
+        hits = geo_index.radius(profession, lon, lat, radius_m)
+        page = []
+        for record, distance in hits:
+            if distance < min_distance or (distance == min_distance and record["username"] in seen):
+                continue
+            page.append(dict(record, distance=distance))
+            if len(page) > page_size:
+                break
+    else:
+        query = {"profession": profession}
+        if seen:
+            query["username"] = {"$nin": seen}
+        geo_near = {
+            "near": {"type": "Point", "coordinates": [lon, lat]},
+            "distanceField": "distance",
+            "maxDistance": radius_m,
+            "query": query,
+            "spherical": True,
+            "key": "location",
+        }
+        if min_distance:
+            geo_near["minDistance"] = min_distance
+        page = await collection.aggregate([
+            {"$geoNear": geo_near},
+            {"$limit": page_size + 1},
+            {"$project": {"_id": 0, "distance": 1, **{field: 1 for field in RESULT_FIELDS}}},
+        ])
+
+    has_more = len(page) > page_size
+    page = page[:page_size]
+    next_cursor = None
+    if has_more:
+        last_distance = page[-1]["distance"]
+        tied = [item["username"] for item in page if item["distance"] == last_distance]
+        if last_distance == min_distance:
+            tied += seen
+        next_cursor = encode_cursor(last_distance, tied)
+    return page, next_cursor
@@ -0,0 +1,104 @@
+from collections import defaultdict
+import os
+from dotenv import load_dotenv
+load_dotenv()
+
+# Lowest trigram similarity (0-1) for a typo to be mapped onto a profession
+PROFESSION_MATCH_THRESHOLD = float(os.getenv('PROFESSION_MATCH_THRESHOLD', 0.5))
+
+
+# Lower-casing and collapsing the whitespace of a profession name
+def clean(name: str):
+    return " ".join(name.lower().split())
+
+
+def trigrams(word: str):
+    padded = f"  {word} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class ProfessionIndex:
+    """Prefix trie plus trigram index over the distinct profession names.
+
+    The trie answers "starts with" completions, the trigram postings catch
+    typos ("plumbr" -> "plumber"). Everything is in memory, built once from
+    User_Auth and extended as professionals register.
+    """
+
+    def __init__(self):
+        self.root = {}
+        self.names = set()
+        self.postings = defaultdict(set)
+        self.ready = False
+
+    def add(self, name: str):
+        name = clean(name)
+        if not name or name in self.names:
+            return
+        self.names.add(name)
+        node = self.root
+        for char in name:
+            node = node.setdefault(char, {})
+        node["$"] = name
+        for gram in trigrams(name):
+            self.postings[gram].add(name)
+
+    # Names starting with the prefix, shortest first
+    def complete(self, prefix: str, limit: int = 10):
+        node = self.root
+        for char in clean(prefix):
+            node = node.get(char)
+            if node is None:
+                return []
+        found = []
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            for key, child in node.items():
+                if key == "$":
+                    found.append(child)
+                else:
+                    stack.append(child)
+        return sorted(found, key=lambda name: (len(name), name))[:limit]
+
+    # Names sharing enough trigrams with the query, best match first, as (name, score) pairs
+    def similar(self, query: str, limit: int = 10):
+        grams = trigrams(clean(query))
+        counts = defaultdict(int)
+        for gram in grams:
+            for name in self.postings.get(gram, ()):
+                counts[name] += 1
+        scored = []
+        for name, common in counts.items():
+            score = 2 * common / (len(grams) + len(trigrams(name)))
+            if score >= PROFESSION_MATCH_THRESHOLD:
+                scored.append((name, score))
+        scored.sort(key=lambda item: (-item[1], item[0]))
+        return scored[:limit]
+
+    # Completions first, then typo matches
+    def suggest(self, query: str, limit: int = 10):
+        suggestions = self.complete(query, limit)
+        for name, score in self.similar(query, limit):
+            if len(suggestions) >= limit:
+                break
+            if name not in suggestions:
+                suggestions.append(name)
+        return suggestions
+
+    # Canonical profession name for a query, or None when nothing is close enough
+    def normalize(self, query: str):
+        query = clean(query)
+        if query in self.names:
+            return query
+        matches = self.similar(query, 1)
+        return matches[0][0] if matches else None
+
+    async def load(self, collection):
+        for name in await collection.distinct("profession"):
+            if isinstance(name, str):
+                self.add(name)
+        self.ready = True
+
+
+profession_index = ProfessionIndex()
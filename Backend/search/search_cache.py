@@ -0,0 +1,141 @@
+from collections import defaultdict
+import asyncio
+import os
+import numpy as np
+from utils.cache import TTLCache
+from . import geohash
+from .geo_index import haversine
+from dotenv import load_dotenv
+load_dotenv()
+
+# Search result cache settings
+SEARCH_CACHE_ENABLED = os.getenv('SEARCH_CACHE_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+SEARCH_CACHE_SIZE = int(os.getenv('SEARCH_CACHE_SIZE', 5000))
+SEARCH_CACHE_TTL = int(os.getenv('SEARCH_CACHE_TTL', 300))
+SEARCH_CACHE_PRECISION = int(os.getenv('SEARCH_CACHE_PRECISION', 6))
+# Moved professionals checked against the cached searches at a time
+SEARCH_CACHE_INVALIDATE_BLOCK = int(os.getenv('SEARCH_CACHE_INVALIDATE_BLOCK', 256))
+
+
+class _Entry:
+    def __init__(self, profession, radius_m, center, margin_m, results):
+        self.profession = profession
+        self.radius_m = radius_m
+        self.center = center
+        self.margin_m = margin_m
+        self.results = results
+        self.lons = np.array([r["location"]["coordinates"][0] for r in results], dtype=float)
+        self.lats = np.array([r["location"]["coordinates"][1] for r in results], dtype=float)
+
+
+class SearchCache:
+    """LRU+TTL cache of nearby-professional searches keyed by geohash cell.
+
+    Callers in the same cell share one entry: (profession, cell, radius). The
+    entry holds every professional within radius plus the cell's half
+    diagonal of the cell centre, so each caller's exact result is recovered by
+    filtering those candidates by their own distance. Registering or moving
+    professionals only drops the entries whose area contains one of their
+    locations, and only the loads still running for those areas are kept
+    out of the cache.
+    """
+
+    def __init__(self, maxsize=SEARCH_CACHE_SIZE, ttl=SEARCH_CACHE_TTL, precision=SEARCH_CACHE_PRECISION):
+        self.precision = precision
+        self.entries = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.keys_by_profession = defaultdict(set)
+        self.inflight = {}
+        # keys whose running load may have missed a professional
+        self.stale = set()
+        self.invalidations = 0
+
+    def _margin(self, cell):
+        (min_lat, max_lat), (min_lon, max_lon) = geohash.bounds(cell)
+        center_lat, center_lon = geohash.decode(cell)
+        corners = np.array([[min_lat, min_lon], [min_lat, max_lon], [max_lat, min_lon], [max_lat, max_lon]])
+        return float(haversine(center_lat, center_lon, corners[:, 0], corners[:, 1]).max())
+
+    async def _load(self, key, loader):
+        profession, cell, radius_m = key
+        center_lat, center_lon = geohash.decode(cell)
+        margin_m = self._margin(cell)
+        try:
+            results = await loader(profession, center_lon, center_lat, radius_m + margin_m)
+        finally:
+            # a professional registered or moved into the area while we were loading
+            stale = key in self.stale
+            self.stale.discard(key)
+        entry = _Entry(profession, radius_m, (center_lat, center_lon), margin_m, results)
+        if not stale:
+            self.entries.set(key, entry)
+            self.keys_by_profession[profession].add(key)
+        return entry
+
+    # Cached search: loader(profession, lon, lat, radius_m) runs only on a miss
+    async def search(self, profession, lon, lat, radius_m, loader):
+        key = (profession, geohash.encode(lat, lon, self.precision), radius_m)
+        entry = self.entries.get(key)
+        if entry is None:
+            # concurrent misses on the same key share one load
+            task = self.inflight.get(key)
+            if task is None:
+                task = asyncio.ensure_future(self._load(key, loader))
+                self.inflight[key] = task
+                task.add_done_callback(lambda _: self.inflight.pop(key, None))
+            entry = await task
+        if not entry.results:
+            return []
+        distances = haversine(lat, lon, entry.lats, entry.lons)
+        inside = np.flatnonzero(distances <= radius_m)
+        order = inside[np.argsort(distances[inside], kind="stable")]
+        return [entry.results[i] for i in order]
+
+    # Dropping the entries whose search area contains a (new or moved) professional
+    def invalidate(self, profession, lon, lat):
+        self.invalidate_many(profession, [(lon, lat)])
+
+    # Same for many locations of one profession at once, e.g. a flush of
+    # location pings: the distances from every location to every cached or
+    # loading area are worked out together
+    def invalidate_many(self, profession, points):
+        keys = self.keys_by_profession.get(profession, set())
+        candidates, centers, reach = [], [], []
+        for key in list(keys):
+            entry = self.entries.peek(key)
+            if entry is None:
+                keys.discard(key)
+                continue
+            candidates.append(key)
+            centers.append(entry.center)
+            reach.append(entry.radius_m + entry.margin_m)
+        for key, task in self.inflight.items():
+            if key[0] == profession and not task.done() and key not in keys:
+                candidates.append(key)
+                centers.append(geohash.decode(key[1]))
+                reach.append(key[2] + self._margin(key[1]))
+        if not candidates or not points:
+            return
+        centers = np.array(centers)
+        reach = np.array(reach)
+        points = np.array(points, dtype=float)
+        hit = np.zeros(len(candidates), dtype=bool)
+        for start in range(0, len(points), SEARCH_CACHE_INVALIDATE_BLOCK):
+            block = points[start:start + SEARCH_CACHE_INVALIDATE_BLOCK]
+            distances = haversine(block[:, 1:2], block[:, 0:1], centers[:, 0], centers[:, 1])
+            hit |= (distances <= reach).any(axis=0)
+        for index in np.flatnonzero(hit):
+            key = candidates[index]
+            if key in self.inflight and not self.inflight[key].done():
+                self.stale.add(key)
+            if key in keys:
+                self.entries.pop(key)
+                keys.discard(key)
+                self.invalidations += 1
+
+    def stats(self):
+        stats = self.entries.stats()
+        stats["invalidations"] = self.invalidations
+        return stats
+
+
+search_cache = SearchCache()
@@ -2,6 +2,7 @@ import 'dart:convert';
 import 'package:flutter/foundation.dart';
 import 'package:http/http.dart' as http;
 import 'package:web_socket_channel/web_socket_channel.dart';
+import 'socket_connect.dart' if (dart.library.io) 'socket_connect_io.dart';
 import 'package:web_socket_channel/status.dart' as status;
 import 'package:dart_jsonwebtoken/dart_jsonwebtoken.dart';
 
@@ -243,8 +244,10 @@ class ApiService {
     }
 
     // debugPrint('Connecting WebSocket for user: $loggedInUsername');
-    channel = WebSocketChannel.connect(
+    // the socket is authenticated with the same session cookie as the API
+    channel = connectWithCookie(
       Uri.parse('ws://127.0.0.1:8000/chat/ws/$loggedInUsername'),
+      sessionCookie,
     );
   }
 
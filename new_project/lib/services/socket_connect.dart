@@ -0,0 +1,7 @@
+import 'package:web_socket_channel/web_socket_channel.dart';
+
+// Browsers send the session cookie with the socket themselves and don't
+// allow setting headers, so the web build connects without one
+WebSocketChannel connectWithCookie(Uri uri, String? cookie) {
+  return WebSocketChannel.connect(uri);
+}
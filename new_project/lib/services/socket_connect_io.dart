@@ -0,0 +1,12 @@
+import 'package:web_socket_channel/io.dart';
+import 'package:web_socket_channel/web_socket_channel.dart';
+
+// On native platforms the session cookie goes in the handshake headers
+WebSocketChannel connectWithCookie(Uri uri, String? cookie) {
+  return IOWebSocketChannel.connect(
+    uri,
+    headers: {
+      if (cookie != null) 'Cookie': cookie,
+    },
+  );
+}